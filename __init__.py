@@ -1,6 +1,7 @@
 import os
+import re
 import json
-from time import sleep
+from time import perf_counter
 import typing as tp
 
 import cudatext as ct
@@ -8,24 +9,33 @@ import cudatext_cmd as ct_cmd
 import cudax_lib as ctx
 
 from . import differ as df
+from .cache import DiffCache, make_key
+from .mapped import MappedLines, can_map
+from . import folders
+from . import merge
+from .profiler import Profile, ProfiledDiffer, NO_PROFILE
+from .painter import Painter, LazyMarkers, DIFF_TAG, NKIND_DELETED, NKIND_ADDED, \
+    NKIND_CHANGED, NKIND_MOVED
 from .scroll import ScrollSplittedTab
 from .ui import DifferDialog, file_history
+from .worker import DiffJob
 
 from cudax_lib import get_translation
 _ = get_translation(__file__)  # I18N
 
-DIFF_TAG = 148
-NKIND_DELETED = 24
-NKIND_ADDED = 25
-NKIND_CHANGED = 26
 GAP_WIDTH = 5000
-DECOR_CHAR = '■'
 DEFAULT_SYNC_SCROLL = '1'
+JOB_TIMER_MS = 50
+JOB_PAINT_CHUNK = 500
+JOB_PAINT_SLICE = 0.03  # seconds of painting per timer tick
+REFRESH_COST_FACTOR = 2  # auto refresh waits this * time of the last one
+CLOSE_TIMEOUT = 2.0  # seconds to wait for closing of tabs in set_files
 
 PLG_NAME = 'Differ'
 METAJSONFILE = os.path.dirname(__file__) + os.sep + 'differ_opts.json'
 JSONFILE = 'cuda_differ.json'  # To store in settings/cuda_differ.json
 JSONPATH = ct.app_path(ct.APP_DIR_SETTINGS) + os.sep + JSONFILE
+CACHE_DIR = ct.app_path(ct.APP_DIR_SETTINGS) + os.sep + 'cuda_differ_cache'
 OPTS_META = [
     {'opt': 'differ.changed_color',
      'cmt': _('Color of changed lines'),
@@ -45,6 +55,12 @@ OPTS_META = [
      'frm': '#rgb-e',
      'chp': 'colors',
      },
+    {'opt': 'differ.moved_color',
+     'cmt': _('Color of moved lines'),
+     'def': '',
+     'frm': '#rgb-e',
+     'chp': 'colors',
+     },
     {'opt': 'differ.gap_color',
      'cmt': _('Color of inter-line gap background'),
      'def': '',
@@ -63,12 +79,111 @@ OPTS_META = [
      'frm': 'bool',
      'chp': 'config',
      },
+    {'opt': 'differ.compare_engine',
+     'cmt': _('Line matching algorithm: "difflib" (SequenceMatcher), "histogram" or "myers" (both are fast on big files)'),
+     'def': 'difflib',
+     'frm': 'strs',
+     'lst': list(df.ENGINES),
+     'chp': 'config',
+     },
     {'opt': 'differ.ratio_percents',
      'cmt': _('Measure of the sequences’ similarity, in percents'),
      'def':  75,
      'frm': 'int',
      'chp': 'config',
      },
+    {'opt': 'differ.detail_granularity',
+     'cmt': _('Parts of changed lines which are compared: "char", "word" (divided by spaces), "token" (words, spaces, single other chars), "auto" (chars, tokens in lines longer than "token_min_chars")'),
+     'def': 'auto',
+     'frm': 'strs',
+     'lst': list(df.GRANULARITIES),
+     'chp': 'config',
+     },
+    {'opt': 'differ.token_min_chars',
+     'cmt': _('Length of line from which "auto" granularity compares tokens'),
+     'def':  df.TOKEN_MIN_CHARS,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.ignore_space',
+     'cmt': _('Match lines ignoring: "eol" - line ends, "change" - changes of spaces amount, "all" - all spaces; "none" - nothing'),
+     'def': 'none',
+     'frm': 'strs',
+     'lst': list(df.IGNORE_SPACE),
+     'chp': 'config',
+     },
+    {'opt': 'differ.ignore_case',
+     'cmt': _('Match lines ignoring case'),
+     'def': False,
+     'frm': 'bool',
+     'chp': 'config',
+     },
+    {'opt': 'differ.ignore_pattern',
+     'cmt': _('Regex, its matches are ignored when lines are matched (e.g. timestamps); empty means none'),
+     'def': '',
+     'frm': 'str',
+     'chp': 'config',
+     },
+    {'opt': 'differ.detect_moves',
+     'cmt': _('Show runs of lines moved to other place of file with "moved" color, they are not compared by symbols'),
+     'def': True,
+     'frm': 'bool',
+     'chp': 'config',
+     },
+    {'opt': 'differ.detail_max_lines',
+     'cmt': _('Changed blocks with more lines (in both files) are not compared in detail, 0 means no limit'),
+     'def':  10000,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.background_min_lines',
+     'cmt': _('Files with more lines (in sum) are compared in background thread and painted by parts, 0 means never'),
+     'def':  20000,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.lazy_detail',
+     'cmt': _('Paint changed symbols only near the visible part of files, more on scrolling'),
+     'def':  True,
+     'frm': 'bool',
+     'chp': 'config',
+     },
+    {'opt': 'differ.cache_items',
+     'cmt': _('Number of last comparision results kept in memory, to show them again without comparing, 0 means none'),
+     'def':  20,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.cache_disk_mb',
+     'cmt': _('Size of comparision results saved to settings folder (in MB), 0 means nothing is saved'),
+     'def':  0,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.folder_workers',
+     'cmt': _('Number of processes to compare folders, 0 means number of CPUs; where processes cannot be forked (Windows), threads are used, they speed up only reading of files'),
+     'def':  0,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.mmap_min_mb',
+     'cmt': _('Saved unmodified UTF-8 files of this size (in MB) and bigger are read from disk by lines, without full copies of texts; 0 means never'),
+     'def':  100,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.detail_workers',
+     'cmt': _('Number of processes to compare big changed blocks by symbols at once, 0 or 1 means no processes; not used for files compared in background (see "background_min_lines"), processes are not forked from threads; not used where processes cannot be forked (Windows)'),
+     'def':  0,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.profile',
+     'cmt': _('Measure times of comparision phases, see command "Show last diff profile"'),
+     'def':  False,
+     'frm': 'bool',
+     'chp': 'config',
+     },
     {'opt': 'differ.enable_sync_caret',
      'cmt': _('Keep carets in both editors visible on current screen area'),
      'def':  False,
@@ -81,6 +196,18 @@ OPTS_META = [
      'frm': 'bool',
      'chp': 'config',
      },
+    {'opt': 'differ.auto_refresh_delay',
+     'cmt': _('Pause after the last change before auto refresh (in ms); on big files the pause is longer, twice the time of the last refresh (with background compare, up to its end); changes made during background compare are refreshed after it ends'),
+     'def':  300,
+     'frm': 'int',
+     'chp': 'config',
+     },
+    {'opt': 'differ.incremental_refresh',
+     'cmt': _('Auto diff refresh compares and repaints only the edited part of files'),
+     'def':  True,
+     'frm': 'bool',
+     'chp': 'config',
+     },
 ]
 
 
@@ -90,6 +217,22 @@ def get_opt(key, def_val: tp.Any = ''):
            else ctx.get_opt('differ.' + key, def_val)
 
 
+def fingerprint(a_text, b_text):
+    """
+    cheap check of texts (str or MappedLines) for auto refresh: equal
+    fingerprints mean there is nothing new to compare
+    """
+    return tuple(t.digest() if isinstance(t, MappedLines) else hash(t)
+                 for t in (a_text, b_text))
+
+
+def same_file(fn1, fn2):
+    if not fn1 or not fn2:
+        return False
+    return os.path.normcase(os.path.abspath(fn1)) == \
+        os.path.normcase(os.path.abspath(fn2))
+
+
 def msg(s, level=0):
     if level == 0:
         print(PLG_NAME + ':', s)
@@ -102,8 +245,23 @@ def msg(s, level=0):
 class Command:
     def __init__(self):
         self.scroll = ScrollSplittedTab(__name__)
-        self.cfg = self.get_config()
+        # options snapshot, made on first use by cfg, see config()
+        self._cfg = None
         self.diff = df.Differ()
+        self.diff_handles = None
+        self.cache = DiffCache(folder=CACHE_DIR)
+        self.job = None
+        self.stopped_job = None  # cancelled job, may be still running
+        self.profile = None
+        self.folder_result = None
+        self.merge_base = None
+        self.fingerprint = None  # of texts compared last time
+        # seconds of the last auto refresh, or of the last background
+        # compare up to its end
+        self.refresh_cost = 0.0
+        self.changed_handle = None
+        self.lazy = None
+        self.lazy_handles = None
         self.diff_dlg = DifferDialog()
 
     def change_config(self):
@@ -128,8 +286,8 @@ class Command:
                 path_keys_info=METAJSONFILE, subset=subset, how=how)
         if op_ed_dlg.show(_('Differ Options')):  # Dialog caption
             # Need to use updated options
-            self.config()
-            self.scroll.toggle(self.cfg['sync_scroll'])
+            self._cfg = None
+            self.scroll.toggle(self.cfg['sync_scroll'], self.cfg['lazy_detail'])
             # self.scroll.enable_sync_caret = self.cfg['enable_sync_caret']
 
     def choose_files(self):
@@ -154,12 +312,151 @@ class Command:
             return
         self.set_files(fn0, fn)
 
+    def compare_folders(self):
+        dir_a = ct.dlg_dir('', _('Differ: first folder'))
+        if not dir_a:
+            return
+        dir_b = ct.dlg_dir(os.path.dirname(dir_a), _('Differ: second folder'))
+        if not dir_b:
+            return
+        if os.path.abspath(dir_a) == os.path.abspath(dir_b):
+            ct.msg_status(_('Cannot compare folder with itself'))
+            return
+
+        def progress(done, total):
+            ct.msg_status(_('Differ: comparing folders... {}/{}')
+                          .format(done, total), True)
+
+        self.config()
+        ct.msg_status(_('Differ: comparing folders...'), True)
+        items, identical = folders.compare_folders(
+            dir_a, dir_b,
+            engine=self.cfg.get('compare_engine'),
+            workers=self.cfg.get('folder_workers'),
+            progress=progress)
+        self.folder_result = (dir_a, dir_b, items, identical)
+        self.show_folders()
+
+    def merge_with_base(self):
+        """
+        three-way mode: choose base file of left and right files,
+        report changes of both sides and conflicts
+        """
+        fn = ct.dlg_file(True, '!', '', '')
+        if not fn:
+            return
+        try:
+            # like text of editors: without BOM, with LF line ends
+            with open(fn, encoding='utf-8-sig', errors='replace') as f:
+                self.merge_base = (fn, f.read().splitlines(True))
+        except OSError as e:
+            msg(e, 2)
+            return
+        hunks = self.merge_hunks()
+        if hunks is None:
+            return
+        kinds = [h[0] for h in hunks]
+        for kind, b1, b2, o1, o2, t1, t2 in hunks:
+            if kind == merge.CONFLICT:
+                msg(_('conflict: left lines {}-{}, right lines {}-{}, base lines {}-{}')
+                    .format(o1+1, o2, t1+1, t2, b1+1, b2))
+        ct.msg_status(_('Differ: left changes {}, right changes {}, same changes {}, conflicts {}')
+                      .format(kinds.count(merge.OURS), kinds.count(merge.THEIRS),
+                              kinds.count(merge.BOTH), kinds.count(merge.CONFLICT)))
+        self.refresh()
+
+    def merge_hunks(self):
+        "merge.merge3 hunks of base, left and right editors, None if no base"
+        if self.merge_base is None:
+            ct.msg_status(_('Choose base file first: "Three-way merge with base..."'))
+            return None
+        a_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_PRIMARY))
+        b_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_SECONDARY))
+        diff = df.Differ()
+        self.config()
+        self.set_diff_options(diff)
+        return merge.merge3(self.merge_base[1],
+                            a_ed.get_text_all().splitlines(True),
+                            b_ed.get_text_all().splitlines(True),
+                            diff.options())
+
+    def merge_take(self, to_right=True):
+        """
+        copy all changes made only in left (to_right) or only in right
+        file against base to the other file, conflicts are left as is;
+        last hunks first, so line numbers of earlier ones stay valid
+        """
+        hunks = self.merge_hunks()
+        if hunks is None:
+            return
+        a_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_PRIMARY))
+        b_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_SECONDARY))
+        kind, src, dst = (merge.OURS, a_ed, b_ed) if to_right else \
+                         (merge.THEIRS, b_ed, a_ed)
+        count = 0
+        for h in reversed(hunks):
+            if h[0] != kind:
+                continue
+            o1, o2, t1, t2 = h[3:]
+            (s1, s2), (d1, d2) = ((o1, o2), (t1, t2)) if to_right else \
+                                 ((t1, t2), (o1, o2))
+            text = src.get_text_substr(0, s1, 0, s2)
+            dst.delete(0, d1, 0, d2)
+            if text:
+                dst.insert(0, d1, text)
+            count += 1
+        ct.msg_status(_('Differ: {} changes copied').format(count))
+        self.refresh()
+
+    def merge_take_left(self):
+        self.merge_take(True)
+
+    def merge_take_right(self):
+        self.merge_take(False)
+
+    def show_folders(self):
+        if self.folder_result is None:
+            ct.msg_status(_('No folders were compared yet'))
+            return
+        dir_a, dir_b, items, identical = self.folder_result
+        if not items:
+            ct.msg_box(_('The folders are identical:\n{0}\n{1}')
+                       .format(dir_a, dir_b), ct.MB_OK)
+            return
+        labels = {
+            folders.ONLY_A: _('only in first folder'),
+            folders.ONLY_B: _('only in second folder'),
+            folders.BINARY: _('binary, changed'),
+            folders.UNREADABLE: _('cannot be read'),
+        }
+        lines = []
+        for status, rel, stat in items:
+            if status == folders.CHANGED:
+                info = '-{} +{}'.format(*stat)
+            else:
+                info = labels[status]
+            lines.append(rel + '\t' + info)
+        caption = _('Differ: {} differ, {} identical').format(len(items),
+                                                              identical)
+        n = ct.dlg_menu(ct.DMENU_LIST, '\n'.join(lines), caption=caption)
+        if n is None:
+            return
+        status, rel, _stat = items[n]
+        if status != folders.CHANGED:
+            ct.msg_status(_('Cannot compare: {}').format(rel))
+            return
+        self.set_files(os.path.join(dir_a, rel), os.path.join(dir_b, rel))
+
     def set_files(self, *files):
+        if self.show_pair(files):
+            self.refresh()
+            return
+        closing = []
         for f in files:
             for h in ct.ed_handles():
                 e = ct.Editor(h)
                 file_name = e.get_filename()
-                if file_name == f:
+                if same_file(file_name, f):
                     if e.get_prop(ct.PROP_MODIFIED):
                         text = _('First you must save file:\n'
                                  '{}'
@@ -175,11 +472,9 @@ class Command:
                             return
                     e.focus()
                     e.cmd(ct_cmd.cmd_FileClose)
-
-                    ct.app_idle(True)  # better close file
-                    sleep(0.3)
-                    ct.app_idle(True)  # better close file
+                    closing.append(h)
                     break
+        self.wait_closed(closing)
 
         ct.file_open(files, options='/nohistory')
 
@@ -191,27 +486,102 @@ class Command:
 
         self.refresh()
 
+    @staticmethod
+    def show_pair(files):
+        """
+        if some tab already shows both files side by side, activate it and
+        return True: files are compared without closing and reading again
+        """
+        for h in ct.ed_handles():
+            e = ct.Editor(h)
+            if e.get_prop(ct.PROP_EDITORS_LINKED):
+                continue
+            a_ed = ct.Editor(e.get_prop(ct.PROP_HANDLE_PRIMARY))
+            b_ed = ct.Editor(e.get_prop(ct.PROP_HANDLE_SECONDARY))
+            if same_file(a_ed.get_filename(), files[0]) and \
+                    same_file(b_ed.get_filename(), files[1]):
+                a_ed.focus()
+                return True
+        return False
+
+    @staticmethod
+    def wait_closed(handles):
+        """
+        process app messages until tabs of handles are closed, instead of
+        fixed sleep; not longer than CLOSE_TIMEOUT
+        """
+        start = perf_counter()
+        while handles and perf_counter() - start < CLOSE_TIMEOUT:
+            opened = ct.ed_handles()
+            handles = [h for h in handles if h in opened]
+            if handles:
+                ct.app_idle(True)
+
     def on_state(self, ed_self, state):
         if state == ct.APPSTATE_THEME_SYNTAX:
-            self.get_config()
+            self._cfg = None
             self.refresh()
 
+    def on_save(self, ed_self):
+        if same_file(ed_self.get_filename(), JSONPATH):
+            self._cfg = None
+
     def on_scroll(self, ed_self):
         self.scroll.on_scroll(ed_self)
+        if self.lazy and ed_self.get_prop(ct.PROP_SPLIT)[0] != '-':
+            self.paint_visible()
 
     def on_caret(self, ed_self):
         if self.cfg.get('enable_sync_caret', False):
             self.sync_caret()
 
     def on_change_slow(self, ed_self):
-        if self.cfg.get('enable_auto_refresh', False):
+        """
+        schedule auto refresh: each change restarts the timer, so a burst
+        of changes gives one refresh; pause is longer for slow refreshes
+        """
+        if not self.cfg.get('enable_auto_refresh', False):
+            return
+        delay = max(self.cfg.get('auto_refresh_delay'),
+                    int(self.refresh_cost * REFRESH_COST_FACTOR * 1000))
+        self.changed_handle = ed_self.get_prop(ct.PROP_HANDLE_SELF)
+        ct.timer_proc(ct.TIMER_STOP, self.on_refresh_timer, 0)
+        ct.timer_proc(ct.TIMER_START_ONE, self.on_refresh_timer, delay)
+
+    def on_refresh_timer(self, tag='', info=''):
+        if ct.ed.get_prop(ct.PROP_EDITORS_LINKED):
+            return
+        handles = (ct.ed.get_prop(ct.PROP_HANDLE_PRIMARY),
+                   ct.ed.get_prop(ct.PROP_HANDLE_SECONDARY))
+        if self.changed_handle not in handles:
+            # other tab was activated since the change
+            return
+        if self.job is not None:
+            # changes during background compare of big files do not
+            # restart it, refresh is made after it ends
+            ct.timer_proc(ct.TIMER_START_ONE, self.on_refresh_timer,
+                          self.cfg.get('auto_refresh_delay'))
+            return
+        a_ed, b_ed = ct.Editor(handles[0]), ct.Editor(handles[1])
+        # changes were undone, or made by copy commands, which refresh
+        if fingerprint(a_ed.get_text_all(), b_ed.get_text_all()) == \
+                self.fingerprint:
+            return
+        start = perf_counter()
+        if not self.cfg.get('incremental_refresh', True) or \
+                not self.refresh_part():
             self.refresh()
+        if self.job is None:
+            # else it is measured when the job ends
+            self.refresh_cost = perf_counter() - start
 
     def on_tab_change(self, ed_self):
-        self.config()
-        self.scroll.toggle(self.cfg.get('sync_scroll'))
+        self.scroll.toggle(self.cfg.get('sync_scroll'),
+                           self.cfg.get('lazy_detail'))
 
     def refresh(self):
+        self.stop_job()
+        ct.timer_proc(ct.TIMER_STOP, self.on_refresh_timer, 0)
         if ct.ed.get_prop(ct.PROP_EDITORS_LINKED):
             return
 
@@ -222,8 +592,16 @@ class Command:
         if a_file == b_file:
             return
 
-        a_text_all = a_ed.get_text_all()
-        b_text_all = b_ed.get_text_all()
+        prof = Profile() if self.cfg.get('profile') else NO_PROFILE
+        a_lines, b_lines = self.map_files(a_ed, b_ed) or (None, None)
+        if a_lines is not None:
+            a_text_all, b_text_all = a_lines, b_lines
+            prof.mark('mmap')
+        else:
+            a_text_all = a_ed.get_text_all()
+            b_text_all = b_ed.get_text_all()
+            prof.mark('get_text_all')
+        self.fingerprint = fingerprint(a_text_all, b_text_all)
 
         if a_text_all == '':
             t = _('The file:\n{}\nis empty.').format(a_file)
@@ -236,6 +614,7 @@ class Command:
             return
 
         if a_text_all == b_text_all:
+            self.close_mapped(a_lines, b_lines)
             t = _('The files are identical:\n{0}\n{1}').format(a_file, b_file)
             ct.msg_box(t, ct.MB_OK)
             return
@@ -246,75 +625,248 @@ class Command:
         self.clear(a_ed)
         self.clear(b_ed)
         self.config()
+        self.lazy = {'-': LazyMarkers(), '+': LazyMarkers()} \
+            if self.cfg.get('lazy_detail') else None
+        self.lazy_handles = (a_ed.get_prop(ct.PROP_HANDLE_SELF),
+                             b_ed.get_prop(ct.PROP_HANDLE_SELF))
 
-        self.diff.set_seqs(a_text_all.splitlines(True),
-                           b_text_all.splitlines(True))
+        prof.mark('clear')
+        if a_lines is None:
+            a_lines = a_text_all.splitlines(True)
+            b_lines = b_text_all.splitlines(True)
+            prof.mark('splitlines')
 
         self.scroll.tab_id.add(ct.ed.get_prop(ct.PROP_TAB_ID))
-        self.scroll.toggle(self.cfg.get('sync_scroll'))
-
-        self.diff.withdetail = self.cfg.get('compare_with_details')
-        self.diff.ratio = self.cfg.get('ratio')
-
-        for d in self.diff.compare():
-            diff_id, y = d[0], d[1]
-            if diff_id == df.A_LINE_DEL:
-                self.set_bookmark2(a_ed, y, NKIND_DELETED)
-                self.set_decor(a_ed, y, DECOR_CHAR, self.cfg.get('color_deleted'))
-            elif diff_id == df.B_LINE_ADD:
-                self.set_bookmark2(b_ed, y, NKIND_ADDED)
-                self.set_decor(b_ed, y, DECOR_CHAR, self.cfg.get('color_added'))
-            elif diff_id == df.A_LINE_CHANGE:
-                self.set_bookmark2(a_ed, y, NKIND_CHANGED)
-            elif diff_id == df.B_LINE_CHANGE:
-                self.set_bookmark2(b_ed, y, NKIND_CHANGED)
-            elif diff_id == df.A_GAP:
-                self.set_gap(a_ed, y, d[2])
-            elif diff_id == df.B_GAP:
-                self.set_gap(b_ed, y, d[2])
-            elif diff_id == df.A_SYMBOL_DEL:
-                self.set_attr(a_ed, d[2], y, d[3], self.cfg.get('color_deleted'))
-            elif diff_id == df.B_SYMBOL_ADD:
-                self.set_attr(b_ed, d[2], y, d[3], self.cfg.get('color_added'))
-            elif diff_id == df.A_DECOR_YELLOW:
-                self.set_decor(a_ed, y, DECOR_CHAR, self.cfg.get('color_changed'))
-            elif diff_id == df.B_DECOR_YELLOW:
-                self.set_decor(b_ed, y, DECOR_CHAR, self.cfg.get('color_changed'))
-            elif diff_id == df.A_DECOR_RED:
-                self.set_decor(a_ed, y, DECOR_CHAR, self.cfg.get('color_deleted'))
-            elif diff_id == df.B_DECOR_GREEN:
-                self.set_decor(b_ed, y, DECOR_CHAR, self.cfg.get('color_added'))
-
-    def set_attr(self, e, x, y, nlen, bg):
-        e.attr(ct.MARKERS_ADD, DIFF_TAG,
-               x,
-               y,
-               nlen,
-               color_bg=bg,
-               show_on_map=True
-               )
-
-    def set_gap(self, e, row, n=1):
-        "set gap line after row line"
-        _, h = e.get_prop(ct.PROP_CELL_SIZE)
-        h_size = h * n
-        e.gap(ct.GAP_ADD, row-1, 0,
-              tag=DIFF_TAG,
-              size=h_size,
-              color=self.cfg.get('color_gaps')
-              )
-
-    def set_decor(self, e, row, text, color):
-        e.decor(ct.DECOR_SET, row, DIFF_TAG, text, color, bold=True)
-
-    def set_bookmark2(self, e, row, nk):
-        e.bookmark(ct.BOOKMARK2_SET, row,
-                   nkind=nk,
-                   text="",
-                   auto_del=True,
-                   show=False,
-                   tag=DIFF_TAG
-                   )
+        self.scroll.toggle(self.cfg.get('sync_scroll'),
+                           self.cfg.get('lazy_detail'))
+
+        if prof is NO_PROFILE:
+            diff = df.Differ(a_lines, b_lines)
+        else:
+            diff = ProfiledDiffer(prof, a_lines, b_lines)
+        self.set_diff_options(diff)
+        self.cache.max_items = self.cfg.get('cache_items')
+        self.cache.max_bytes = self.cfg.get('cache_disk_mb') * 1024 * 1024
+        key = make_key(a_text_all, b_text_all, diff)
+        cached = self.cache.get(key)
+        prof.mark('cache')
+        if cached:
+            events, hunks = cached
+            diff.diffmap = df.DiffMap(hunks)
+        else:
+            min_lines = self.cfg.get('background_min_lines')
+            if min_lines and len(a_lines) + len(b_lines) >= min_lines:
+                self.start_job(a_ed, b_ed, diff, key, prof)
+                return
+            events = diff.events()
+            prof.mark('detail and events')
+            self.cache.put(key, events, diff.diffmap)
+            prof.mark('cache')
+        self.close_mapped(a_lines, b_lines)
+
+        self.diff = diff
+        painter = self.paint(a_ed, b_ed, events)
+        prof.mark('paint')
+        self.diff_handles = (a_ed.get_prop(ct.PROP_HANDLE_SELF),
+                             b_ed.get_prop(ct.PROP_HANDLE_SELF))
+        self.end_profile(prof, events, painter)
+
+    def end_profile(self, prof, events, painter):
+        if prof is NO_PROFILE:
+            return
+        prof.count_events(events)
+        prof.api_calls = painter.calls
+        self.profile = prof
+        msg('profile ' + json.dumps(prof.as_dict()))
+
+    def show_profile(self):
+        if self.profile is None:
+            ct.msg_status(_('No diff profile yet, turn on option "profile" and refresh'))
+            return
+        ct.msg_box(self.profile.report(), ct.MB_OK+ct.MB_ICONINFO)
+
+    def map_files(self, a_ed, b_ed):
+        """
+        (MappedLines, MappedLines) of both files if they are big enough for
+        option "mmap_min_mb", saved, utf-8 and with LF/CRLF line ends,
+        else None
+        """
+        min_bytes = self.cfg.get('mmap_min_mb') * 1024 * 1024
+        files = []
+        for e in (a_ed, b_ed):
+            fn = e.get_filename()
+            enc = e.get_prop(ct.PROP_ENC).lower().replace('-', '')
+            if e.get_prop(ct.PROP_MODIFIED) or not enc.startswith('utf8') or \
+                    e.get_prop(ct.PROP_NEWLINE) == 'cr' or not os.path.isfile(fn):
+                return None
+            files.append(fn)
+        if not any(can_map(fn, min_bytes) for fn in files):
+            return None
+        lines = []
+        try:
+            for fn in files:
+                lines.append(MappedLines(fn))
+        except (OSError, ValueError):
+            self.close_mapped(*lines)
+            return None
+        return lines
+
+    @staticmethod
+    def close_mapped(*seqs):
+        """
+        close mapped files, after compare their lines are not needed:
+        next refresh reads editors again, if files were changed
+        """
+        for s in seqs:
+            if isinstance(s, MappedLines):
+                s.close()
+
+    def set_diff_options(self, diff):
+        diff.withdetail = self.cfg.get('compare_with_details')
+        diff.ratio = self.cfg.get('ratio')
+        diff.engine = self.cfg.get('compare_engine')
+        diff.replace_limit = self.cfg.get('detail_max_lines')
+        diff.granularity = self.cfg.get('detail_granularity')
+        diff.token_min_chars = self.cfg.get('token_min_chars')
+        diff.detect_moves = self.cfg.get('detect_moves')
+        diff.ignore_space = self.cfg.get('ignore_space')
+        diff.ignore_case = self.cfg.get('ignore_case')
+        diff.ignore_patterns = ()
+        pattern = self.cfg.get('ignore_pattern')
+        if pattern:
+            try:
+                re.compile(pattern)
+                diff.ignore_patterns = (pattern,)
+            except re.error as e:
+                msg(_('Bad option "ignore_pattern": {}').format(e), 1)
+        diff.workers = self.cfg.get('detail_workers')
+
+    def start_job(self, a_ed, b_ed, diff, key, prof=NO_PROFILE):
+        self.job = DiffJob(diff, self.stopped_job)
+        self.job_key = key
+        self.job_profile = prof
+        self.job_eds = (a_ed, b_ed)
+        self.job_painter = Painter(a_ed, b_ed, self.cfg, self.lazy)
+        self.job_painted = 0
+        self.job_start = perf_counter()
+        self.job.start()
+        ct.timer_proc(ct.TIMER_START, self.on_job_timer, JOB_TIMER_MS)
+
+    def stop_job(self):
+        if self.job is None:
+            return
+        self.job.cancel()
+        self.close_mapped(self.job.differ.a, self.job.differ.b)
+        self.stopped_job = self.job if not self.job.done else None
+        self.job = None
+        ct.timer_proc(ct.TIMER_STOP, self.on_job_timer, 0)
+
+    def on_job_timer(self, tag='', info=''):
+        job = self.job
+        if job is None:
+            ct.timer_proc(ct.TIMER_STOP, self.on_job_timer, 0)
+            return
+        if job.error is not None:
+            self.stop_job()
+            msg(job.error, 2)
+            return
+
+        # paint events found so far, for not more than JOB_PAINT_SLICE
+        done = job.done
+        count = len(job.events)
+        start = perf_counter()
+        while self.job_painted < count and \
+                perf_counter() - start < JOB_PAINT_SLICE:
+            n = self.job_painted
+            self.job_painter.add(job.events[n:min(n+JOB_PAINT_CHUNK, count)])
+            self.job_painter.apply()
+            self.job_painted = min(n+JOB_PAINT_CHUNK, count)
+        if self.lazy:
+            self.job_painter.calls += self.paint_visible()
+
+        if not done:
+            ct.msg_status(_('Differ: comparing... {} changes painted')
+                          .format(self.job_painted))
+        elif self.job_painted < count:
+            ct.msg_status(_('Differ: painting... {}%')
+                          .format(100 * self.job_painted // count))
+        else:
+            self.stop_job()
+            self.refresh_cost = perf_counter() - self.job_start
+            a_ed, b_ed = self.job_eds
+            self.diff = job.differ
+            self.cache.put(self.job_key, job.events, job.differ.diffmap)
+            self.job_profile.mark('background compare and paint')
+            self.end_profile(self.job_profile, job.events, self.job_painter)
+            self.diff_handles = (a_ed.get_prop(ct.PROP_HANDLE_SELF),
+                                 b_ed.get_prop(ct.PROP_HANDLE_SELF))
+            ct.msg_status(_('Differ: {} editor calls, {} saved by batching')
+                          .format(self.job_painter.calls,
+                                  self.job_painter.saved))
+
+    def refresh_part(self):
+        """
+        compare and repaint only the edited part of both files,
+        return False if full refresh is needed
+        """
+        if self.job is not None or ct.ed.get_prop(ct.PROP_EDITORS_LINKED):
+            return False
+        a_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_PRIMARY))
+        b_ed = ct.Editor(ct.ed.get_prop(ct.PROP_HANDLE_SECONDARY))
+        handles = (a_ed.get_prop(ct.PROP_HANDLE_SELF),
+                   b_ed.get_prop(ct.PROP_HANDLE_SELF))
+        if handles != self.diff_handles or \
+                not self.diff.diffmap or isinstance(self.diff.a, MappedLines):
+            return False
+        a_text_all = a_ed.get_text_all()
+        b_text_all = b_ed.get_text_all()
+        if not a_text_all or not b_text_all or a_text_all == b_text_all:
+            return False
+
+        self.fingerprint = fingerprint(a_text_all, b_text_all)
+        a_len, b_len = len(self.diff.a), len(self.diff.b)
+        part = self.diff.rediff(a_text_all.splitlines(True),
+                                b_text_all.splitlines(True))
+        if part is None:
+            return True
+        alo, ahi, blo, bhi, events = part
+        self.clear_rows(a_ed, alo, ahi)
+        self.clear_rows(b_ed, blo, bhi)
+        if self.lazy:
+            self.lazy['-'].replace(alo, ahi, len(self.diff.a) - a_len)
+            self.lazy['+'].replace(blo, bhi, len(self.diff.b) - b_len)
+        self.paint(a_ed, b_ed, events)
+        return True
+
+    def paint(self, a_ed, b_ed, events):
+        painter = Painter(a_ed, b_ed, self.cfg, self.lazy)
+        painter.add(events)
+        painter.apply()
+        if self.lazy:
+            painter.calls += self.paint_visible()
+        ct.msg_status(_('Differ: {} editor calls, {} saved by batching')
+                      .format(painter.calls, painter.saved))
+        return painter
+
+    def paint_visible(self):
+        "paint symbol markers near visible lines, return number of editor calls"
+        handles = (ct.ed.get_prop(ct.PROP_HANDLE_PRIMARY),
+                   ct.ed.get_prop(ct.PROP_HANDLE_SECONDARY))
+        if handles != self.lazy_handles:
+            return 0
+        return self.lazy['-'].paint(ct.Editor(handles[0])) + \
+            self.lazy['+'].paint(ct.Editor(handles[1]))
+
+    def clear_rows(self, e, y1, y2):
+        "clear marks of lines y1...y2-1, and gaps painted above them"
+        e.gap(ct.GAP_DELETE, y1-1, y2-1)
+        for m in e.attr(ct.MARKERS_GET) or []:
+            tag, x, y = m[:3]
+            if tag == DIFF_TAG and y1 <= y < y2:
+                e.attr(ct.MARKERS_DELETE_BY_POS, x=x, y=y)
+        for y in range(y1, y2):
+            e.decor(ct.DECOR_DELETE_BY_LINE, line=y)
+            e.bookmark(ct.BOOKMARK2_CLEAR, y)
 
     def clear(self, e):
         if e is None:
@@ -324,13 +876,21 @@ class Command:
         e.decor(ct.DECOR_DELETE_BY_TAG, tag=DIFF_TAG)
         e.bookmark(ct.BOOKMARK2_DELETE_BY_TAG, 0, tag=DIFF_TAG)
 
+    @property
+    def cfg(self):
+        """
+        options snapshot; it is dropped on theme change (on_state), on
+        saving of options file (on_save) and after options dialog
+        """
+        if self._cfg is None:
+            self._cfg = self.get_config()
+        return self._cfg
+
     def config(self):
+        "before compare: drop snapshot if options file was changed outside"
         opt_time = os.path.getmtime(JSONPATH) if os.path.exists(JSONPATH) else 0
-        theme_name = ct.app_proc(ct.PROC_THEME_SYNTAX_GET, '')
-        if self.cfg.get('opt_time') == opt_time and \
-           self.cfg.get('theme_name') == theme_name:
-            return
-        self.cfg = self.get_config()
+        if self._cfg is not None and self._cfg.get('opt_time') != opt_time:
+            self._cfg = None
 
     @staticmethod
     def get_config():
@@ -355,37 +915,75 @@ class Command:
             th['color_changed'] = data['LightBG2']['color_back']
             th['color_added'] = data['LightBG3']['color_back']
             th['color_deleted'] = data['LightBG1']['color_back']
+            th['color_moved'] = data.get('LightBG4', data['LightBG2'])['color_back']
             return th
 
         t = get_theme()
         config = {
             'opt_time':
                 os.path.getmtime(JSONPATH) if os.path.exists(JSONPATH) else 0,
-            'theme_name':
-                ct.app_proc(ct.PROC_THEME_SYNTAX_GET, ''),
             'color_changed':
                 get_color('changed_color', t.get('color_changed')),
             'color_added':
                 get_color('added_color', t.get('color_added')),
             'color_deleted':
                 get_color('deleted_color', t.get('color_deleted')),
+            'color_moved':
+                get_color('moved_color', t.get('color_moved')),
             'color_gaps':
                 get_color('gap_color', ct.COLOR_NONE),
             'sync_scroll':
                 get_opt('sync_scroll', DEFAULT_SYNC_SCROLL == '1'),
             'compare_with_details':
                 get_opt('compare_with_details', True),
+            'compare_engine':
+                get_opt('compare_engine', 'difflib'),
             'ratio':
                 get_opt('ratio_percents',  75)/100,
+            'detail_max_lines':
+                get_opt('detail_max_lines', 10000),
+            'detail_granularity':
+                get_opt('detail_granularity', 'auto'),
+            'token_min_chars':
+                get_opt('token_min_chars', df.TOKEN_MIN_CHARS),
+            'detect_moves':
+                get_opt('detect_moves', True),
+            'ignore_space':
+                get_opt('ignore_space', 'none'),
+            'ignore_case':
+                get_opt('ignore_case', False),
+            'ignore_pattern':
+                get_opt('ignore_pattern', ''),
+            'background_min_lines':
+                get_opt('background_min_lines', 20000),
+            'lazy_detail':
+                get_opt('lazy_detail', True),
+            'cache_items':
+                get_opt('cache_items', 20),
+            'cache_disk_mb':
+                get_opt('cache_disk_mb', 0),
+            'folder_workers':
+                get_opt('folder_workers', 0),
+            'mmap_min_mb':
+                get_opt('mmap_min_mb', 100),
+            'detail_workers':
+                get_opt('detail_workers', 0),
+            'profile':
+                get_opt('profile', False),
             'enable_sync_caret':
                 get_opt('enable_sync_caret', False),
             'enable_auto_refresh':
                 get_opt('enable_auto_refresh', False),
+            'auto_refresh_delay':
+                get_opt('auto_refresh_delay', 300),
+            'incremental_refresh':
+                get_opt('incremental_refresh', True),
         }
 
         new_nkind(NKIND_DELETED, config.get('color_deleted'))
         new_nkind(NKIND_ADDED, config.get('color_added'))
         new_nkind(NKIND_CHANGED, config.get('color_changed'))
+        new_nkind(NKIND_MOVED, config.get('color_moved'))
 
         return config
 
@@ -393,6 +991,10 @@ class Command:
         file_history.clear()
         file_history.save()
 
+    def clear_cache(self):
+        self.cache.clear()
+        ct.msg_status(_('Differ: comparision cache cleared'))
+
     @property
     def focused(self):
         hndl_self = ct.ed.get_prop(ct.PROP_HANDLE_SELF)
@@ -411,20 +1013,15 @@ class Command:
             return ct.msg_status(_("No differences were found"))
         fc, eds = self.focused
 
-        i = None
         if fc == 0:
             p = 0 if to_next else 1
         else:
             p = 2 if to_next else 3
         y = eds[fc].get_carets()[0][1]
-        for n, df in enumerate(self.diff.diffmap):
-            if y < df[p]:
-                i = n if to_next else n - 1
-                break
-
-        if i is None:
-            i = 0 if to_next else len(self.diff.diffmap) - 1
-        elif i >= len(self.diff.diffmap):
+        n = self.diff.diffmap.after(y, p)
+        i = n if to_next else n - 1
+
+        if i >= len(self.diff.diffmap):
             i = 0
         elif i < 0:
             i = len(self.diff.diffmap) - 1
@@ -443,11 +1040,10 @@ class Command:
         if not self.diff.diffmap:
             self.refresh()
         fc, eds = self.focused
-        p = fc * 2
         y = eds[fc].get_carets()[0][1]
-        for df in self.diff.diffmap:
-            if df[p] <= y < df[p+1]:
-                return df
+        n = self.diff.diffmap.find(y, fc)
+        if n is not None:
+            return self.diff.diffmap[n]
 
     def select_current(self):
         cur_change = self.get_current_change
@@ -540,15 +1136,17 @@ class Command:
 
         esc = self.cfg.get('enable_sync_caret', False)
         p = fc * 2
-        for df in self.diff.diffmap:
-            if df[p] <= y < df[p+1]:
-                self.cfg['enable_sync_caret'] = False
-                eds[op].set_caret(0, df[op*2])
-                self.cfg['enable_sync_caret'] = esc
-                return
-        for df in self.diff.diffmap:
-            if y < df[p]:
-                self.cfg['enable_sync_caret'] = False
-                eds[op].set_caret(x, df[op*2]-df[p]+y)
-                self.cfg['enable_sync_caret'] = esc
-                return
+        n = self.diff.diffmap.find(y, fc)
+        if n is not None:
+            df = self.diff.diffmap[n]
+            self.cfg['enable_sync_caret'] = False
+            eds[op].set_caret(0, df[op*2])
+            self.cfg['enable_sync_caret'] = esc
+            return
+        n = self.diff.diffmap.after(y, p)
+        if n < len(self.diff.diffmap):
+            df = self.diff.diffmap[n]
+            self.cfg['enable_sync_caret'] = False
+            eds[op].set_caret(x, df[op*2]-df[p]+y)
+            self.cfg['enable_sync_caret'] = esc
+            return
@@ -0,0 +1,170 @@
+"""
+Benchmark of differ.Differ, runs without CudaText, from plugin folder:
+    python bench.py                  run all corpora, compare with baseline
+                                     (exit code 1 if slower or other events)
+    python bench.py --save           run and save results as new baseline
+    python bench.py --files A B      add real files A and B as a corpus
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tracemalloc
+from time import perf_counter
+
+if __package__:
+    from . import differ as df
+else:
+    import differ as df
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'bench_baseline.json')
+TOLERANCE = 0.25  # slower than baseline by this part is a regression
+MIN_DELTA = 0.05  # seconds, smaller slowdowns are noise
+WORDS = ['self', 'value', 'return', 'data', 'item', 'count', 'None',
+         'if', 'for', 'in', 'def', 'name', 'key', 'result', '=', '+']
+
+
+def words_line(rnd, n=8):
+    return ' '.join(rnd.choice(WORDS) for _ in range(n)) + '\n'
+
+
+def edit_lines(rnd, lines, count, new_line):
+    lines = list(lines)
+    for _ in range(count):
+        y = rnd.randrange(len(lines))
+        kind = rnd.randrange(3)
+        if kind == 0:
+            lines[y] = new_line(rnd)
+        elif kind == 1:
+            lines.insert(y, new_line(rnd))
+        else:
+            del lines[y]
+    return lines
+
+
+def huge_few_edits(rnd, scale):
+    a = ['%6d %s' % (y, words_line(rnd)) for y in range(int(200000*scale))]
+    return a, edit_lines(rnd, a, 20, words_line)
+
+
+def scattered_edits(rnd, scale):
+    a = [words_line(rnd) for _ in range(int(50000*scale))]
+    return a, edit_lines(rnd, a, int(2000*scale), words_line)
+
+
+def big_replace(rnd, scale):
+    n = int(3000*scale)
+    head = [words_line(rnd) for _ in range(100)]
+    a = head + [words_line(rnd) for _ in range(n)] + head
+    b = head + [s[:10] + 'X' + s[11:] if rnd.random() < 0.7
+                else words_line(rnd) for s in a[100:-100]] + head
+    return a, b
+
+
+def long_lines(rnd, scale):
+    a = [words_line(rnd, 4000) for _ in range(int(100*scale))]
+    b = []
+    for s in a:
+        x = rnd.randrange(len(s) - 10)
+        b.append(s[:x] + 'CHANGED' + s[x+5:])
+    return a, b
+
+
+def repeated_lines(rnd, scale):
+    pool = [words_line(rnd) for _ in range(10)] + ['}\n', '\n']
+    a = [rnd.choice(pool) for _ in range(int(50000*scale))]
+    return a, edit_lines(rnd, a, int(500*scale), lambda r: r.choice(pool))
+
+
+CORPORA = [huge_few_edits, scattered_edits, big_replace, long_lines,
+           repeated_lines]
+
+
+def run(a, b, withdetail, engine):
+    diff = df.Differ(a, b)
+    diff.withdetail = withdetail
+    diff.engine = engine
+    start = perf_counter()
+    count = sum(1 for _ in diff.compare())
+    seconds = perf_counter() - start
+
+    tracemalloc.start()
+    diff = df.Differ(a, b)
+    diff.withdetail = withdetail
+    diff.engine = engine
+    for _ in diff.compare():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': round(seconds, 4), 'peak_kb': peak // 1024,
+            'events': count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of differ.Differ')
+    parser.add_argument('--engine', default='difflib',
+                        choices=sorted(df.ENGINES))
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply sizes of generated corpora')
+    parser.add_argument('--only', help='run only corpora with this in name')
+    parser.add_argument('--files', nargs=2, action='append', default=[],
+                        metavar=('A', 'B'), help='compare real files too')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='save results as new baseline')
+    args = parser.parse_args()
+
+    corpora = []
+    for gen in CORPORA:
+        if not args.only or args.only in gen.__name__:
+            corpora.append((gen.__name__,
+                            lambda gen=gen: gen(random.Random(1), args.scale)))
+    for fn_a, fn_b in args.files:
+        def read(fn_a=fn_a, fn_b=fn_b):
+            with open(fn_a, encoding='utf-8', errors='replace') as fa, \
+                    open(fn_b, encoding='utf-8', errors='replace') as fb:
+                return fa.read().splitlines(True), fb.read().splitlines(True)
+        corpora.append(('files:%s:%s' % (os.path.basename(fn_a),
+                                          os.path.basename(fn_b)), read))
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    results = {}
+    regressions = 0
+    print('%-40s %10s %10s %10s' % ('corpus', 'seconds', 'peak KB', 'events'))
+    for name, load in corpora:
+        a, b = load()
+        for withdetail in (False, True):
+            key = '%s/%s/%s' % (name, args.engine,
+                                'detail' if withdetail else 'lines')
+            res = run(a, b, withdetail, args.engine)
+            results[key] = res
+            note = ''
+            old = baseline.get(key)
+            if old:
+                if res['seconds'] > old['seconds'] * (1 + TOLERANCE) and \
+                        res['seconds'] - old['seconds'] > MIN_DELTA:
+                    note = ' SLOWER (was %.4f)' % old['seconds']
+                    regressions += 1
+                if res['events'] != old['events']:
+                    note += ' EVENTS CHANGED (was %d)' % old['events']
+                    regressions += 1
+            print('%-40s %10.4f %10d %10d%s' % (key, res['seconds'],
+                  res['peak_kb'], res['events'], note))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline saved:', args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+import marshal
+import zlib
+from collections import OrderedDict
+from hashlib import sha1
+
+from .differ import DiffEvents
+
+
+def make_key(a_text, b_text, diff):
+    """
+    key of compare() result: hashes of both texts and all Differ options
+    which change the result; texts can be mapped.MappedLines too
+    """
+    h = sha1()
+    for s in (a_text, b_text):
+        h.update(s.digest() if hasattr(s, 'digest') else
+                 sha1(s.encode('utf-8', 'surrogatepass')).digest())
+    h.update(repr(sorted(diff.options().items())).encode())
+    return h.hexdigest()
+
+
+class DiffCache:
+    """
+    compare() results (events, diffmap blocks) by make_key(), last used
+    max_items kept in memory; if folder is given, results are also saved
+    there, oldest files are deleted when all are bigger than max_bytes
+    """
+    def __init__(self, max_items=20, folder='', max_bytes=0):
+        self.items = OrderedDict()
+        self.max_items = max_items
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        if not self.folder or not self.max_bytes:
+            return None
+        fn = os.path.join(self.folder, key)
+        try:
+            with open(fn, 'rb') as f:
+                events, hunks = marshal.loads(zlib.decompress(f.read()))
+            value = DiffEvents.load(events), hunks
+            os.utime(fn)
+        except (OSError, ValueError, EOFError, TypeError, zlib.error):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, events, hunks):
+        if not isinstance(events, DiffEvents):
+            events = DiffEvents(events)
+        hunks = [list(h) for h in hunks]
+        self._remember(key, (events, hunks))
+        if not self.folder or not self.max_bytes:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, key), 'wb') as f:
+                f.write(zlib.compress(marshal.dumps((events.dump(), hunks)),
+                                      1))
+        except OSError:
+            return
+        self._shrink()
+
+    def clear(self):
+        self.items.clear()
+        if not self.folder or not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def _remember(self, key, value):
+        if self.max_items <= 0:
+            return
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def _shrink(self):
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,167 @@
+"""
+Compare two files without CudaText, from plugin folder:
+    python cli.py [options] FILE_A FILE_B
+Output is streamed: JSON lines with compare() events (default),
+or unified diff with --unified.
+With --base BASE, changes of FILE_A and FILE_B against BASE are merged,
+result with conflict markers is printed.
+It is run as a script, or imported with plugin folder in sys.path
+(import cli): as cuda_differ.cli it would run plugin __init__.py,
+which needs CudaText.
+"""
+import sys
+import json
+import argparse
+
+if __package__:
+    from . import differ as df
+    from . import merge
+else:
+    import differ as df
+    import merge
+
+
+def read_lines(fn, encoding):
+    with open(fn, encoding=encoding, errors='replace', newline='') as f:
+        return f.read().splitlines(True)
+
+
+def json_lines(diff):
+    yield json.dumps({'a_lines': len(diff.a), 'b_lines': len(diff.b)}) + '\n'
+    for d in diff.compare():
+        yield json.dumps(d) + '\n'
+
+
+def grouped_opcodes(opcodes, n=3):
+    """the same as SequenceMatcher.get_grouped_opcodes, for ready opcodes"""
+    codes = list(opcodes) or [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2-n), i2, max(j1, j2-n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1+n), j1, min(j2, j1+n)
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2-i1 > nn:
+            group.append((tag, i1, min(i2, i1+n), j1, min(j2, j1+n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2-n), max(j1, j2-n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def unified(diff, fn_a, fn_b, n=3):
+    def head(start, stop):
+        length = stop - start
+        if length == 1:
+            return str(start + 1)
+        if not length:
+            start -= 1
+        return '%d,%d' % (start + 1, length)
+
+    def line(prefix, s):
+        return prefix + s if s.endswith(('\n', '\r')) else \
+               prefix + s + '\n\\ No newline at end of file\n'
+
+    a, b = diff.a, diff.b
+    started = False
+    for group in grouped_opcodes(diff.get_opcodes(), n):
+        if not started:
+            started = True
+            yield '--- %s\n+++ %s\n' % (fn_a, fn_b)
+        first, last = group[0], group[-1]
+        yield '@@ -%s +%s @@\n' % (head(first[1], last[2]),
+                                   head(first[3], last[4]))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for s in a[i1:i2]:
+                    yield line(' ', s)
+                continue
+            for s in a[i1:i2]:
+                yield line('-', s)
+            for s in b[j1:j2]:
+                yield line('+', s)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare two files with the Differ plugin engine')
+    parser.add_argument('file_a')
+    parser.add_argument('file_b')
+    parser.add_argument('--unified', action='store_true',
+                        help='print unified diff instead of JSON lines')
+    parser.add_argument('--base',
+                        help='three-way merge of FILE_A and FILE_B with BASE')
+    parser.add_argument('--context', type=int, default=3,
+                        help='context lines of unified diff')
+    parser.add_argument('--no-detail', dest='withdetail',
+                        action='store_false',
+                        help='do not compare changed lines by symbols')
+    parser.add_argument('--ratio', type=int, default=75,
+                        help='similarity of changed lines, in percents')
+    parser.add_argument('--engine', default='difflib',
+                        choices=sorted(df.ENGINES))
+    parser.add_argument('--granularity', default='auto',
+                        choices=df.GRANULARITIES,
+                        help='parts of changed lines which are compared')
+    parser.add_argument('--no-moves', dest='detect_moves',
+                        action='store_false',
+                        help='do not detect moved lines')
+    parser.add_argument('--ignore-space', default='none',
+                        choices=df.IGNORE_SPACE,
+                        help='match lines ignoring line ends or spaces')
+    parser.add_argument('--ignore-case', action='store_true')
+    parser.add_argument('--ignore-pattern', action='append', default=[],
+                        metavar='REGEX',
+                        help='match lines ignoring texts found by REGEX')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='processes for detail of big changed blocks '
+                             '(not used without fork)')
+    parser.add_argument('--encoding', default='utf-8')
+    args = parser.parse_args()
+
+    diff = df.Differ(read_lines(args.file_a, args.encoding),
+                     read_lines(args.file_b, args.encoding))
+    diff.withdetail = args.withdetail
+    diff.ratio = args.ratio / 100
+    diff.engine = args.engine
+    diff.granularity = args.granularity
+    diff.detect_moves = args.detect_moves
+    diff.ignore_space = args.ignore_space
+    diff.ignore_case = args.ignore_case
+    diff.ignore_patterns = tuple(args.ignore_pattern)
+    diff.workers = args.workers
+
+    if args.base:
+        base = read_lines(args.base, args.encoding)
+        hunks = merge.merge3(base, diff.a, diff.b, diff.options())
+        out = merge.merged_lines(base, diff.a, diff.b, hunks,
+                                 (args.file_a, args.file_b))
+    elif args.unified:
+        out = unified(diff, args.file_a, args.file_b, args.context)
+    else:
+        out = json_lines(diff)
+    changed = False
+    write = sys.stdout.write
+    try:
+        for s in out:
+            changed = True
+            write(s)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # output closed early, like by "| head"
+        sys.stderr.close()
+    # like diff: 1 if files differ; like merge: 1 if there are conflicts
+    if args.base:
+        return 1 if any(h[0] == merge.CONFLICT for h in hunks) else 0
+    if args.unified:
+        return 1 if changed else 0
+    return 1 if diff.diffmap else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,33 @@
+import re
+import multiprocessing
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import accumulate, chain
 from difflib import SequenceMatcher
+from math import isqrt
 
 
+HISTOGRAM_MAX_CHAIN = 64
+MYERS_MIN_COST = 256
+FANCY_INDEX_PAIRS = 2500
+FANCY_CANDIDATES = 8
+FANCY_MAX_POSTING = 64
+REDIFF_MARGIN = 3
+PARALLEL_MIN_PAIRS = 400  # smaller replace blocks are not sent to workers
+MOVE_MIN_LINES = 3  # moved runs have at least so many not blank lines
+MOVE_CANDIDATES = 8  # lines found more times in changed b don't start moves
+TOKEN_MIN_CHARS = 2000  # 'auto' granularity uses tokens for longer lines
+GRANULARITIES = ('auto', 'char', 'word', 'token')
+IGNORE_SPACE = ('none', 'eol', 'change', 'all')
+SPACES_RE = re.compile(r'\s+')
+SPLIT_RE = {
+    'word': re.compile(r'\s+|\S+'),
+    'token': re.compile(r'\w+|\s+|[^\w\s]'),
+}
+
 A_LINE_DEL = '-'
 B_LINE_ADD = '+'
 A_LINE_CHANGE = '-*'
@@ -13,6 +40,171 @@ A_DECOR_YELLOW = '-y'
 A_DECOR_RED = '-r'
 B_DECOR_YELLOW = '+y'
 B_DECOR_GREEN = '+g'
+A_LINE_MOVED = '-m'
+B_LINE_MOVED = '+m'
+
+# kinds of events in DiffEvents, and number of items in their tuples
+KINDS = (A_LINE_DEL, B_LINE_ADD, A_LINE_CHANGE, B_LINE_CHANGE,
+         A_DECOR_YELLOW, B_DECOR_YELLOW, A_DECOR_RED, B_DECOR_GREEN,
+         A_GAP, B_GAP, A_SYMBOL_DEL, B_SYMBOL_ADD, A_LINE_MOVED, B_LINE_MOVED)
+KIND_IDS = {kind: n for n, kind in enumerate(KINDS)}
+KIND_SIZES = array('B', [2]*8 + [3]*2 + [4]*2 + [3]*2)
+KIND_SIDES = array('B', [kind[0] == '+' for kind in KINDS])  # 0 a, 1 b
+# detail workers are processes made by fork, where it is (not Windows)
+HAS_FORK = 'fork' in multiprocessing.get_all_start_methods()
+
+
+class Cancelled(Exception):
+    "compare was stopped, Differ.stop returned True"
+
+
+class DiffMap:
+    """
+    changed blocks [a1, a2, b1, b2] (lines a1...a2-1 of a replaced with
+    b1...b2-1 of b), kept in 4 sorted arrays for bisect lookups
+    """
+    def __init__(self, hunks=()):
+        self.cols = [array('i') for _ in range(4)]
+        for h in hunks:
+            self.append(h)
+
+    def append(self, hunk):
+        for col, v in zip(self.cols, hunk):
+            col.append(v)
+
+    def __len__(self):
+        return len(self.cols[0])
+
+    def __getitem__(self, n):
+        return [col[n] for col in self.cols]
+
+    def __iter__(self):
+        return (list(h) for h in zip(*self.cols))
+
+    def after(self, y, p):
+        """
+        index of the first block with [a1, a2, b1, b2][p] > y,
+        len(self) if there is none
+        """
+        return bisect_right(self.cols[p], y)
+
+    def find(self, y, side):
+        """
+        index of the block with line y of a (side 0) or b (side 1),
+        None if y is not changed
+        """
+        n = bisect_right(self.cols[side*2], y) - 1
+        if n >= 0 and y < self.cols[side*2+1][n]:
+            return n
+
+
+class DiffEvents:
+    """
+    compare() events kept in 4 typed arrays: kind (index in KINDS), line,
+    column and length (size for gaps), instead of a tuple per event;
+    iteration gives the same tuples as compare(), slices are DiffEvents;
+    between() selects events of a range of lines
+    """
+    def __init__(self, events=()):
+        self.kinds = array('B')
+        self.rows = array('i')
+        self.cols = array('i')
+        self.lens = array('i')
+        # (number of indexed events, per side (lines, positions) sorted
+        # by line), made by between()
+        self._index = None
+        self.extend(events)
+
+    def extend(self, events):
+        kinds, rows, cols, lens = self.kinds, self.rows, self.cols, self.lens
+        ids = KIND_IDS
+        for d in events:
+            # lens is filled last: len() is safe to read from other thread
+            kinds.append(ids[d[0]])
+            rows.append(d[1])
+            if len(d) == 2:
+                cols.append(0)
+                lens.append(0)
+            elif len(d) == 3:
+                cols.append(0)
+                lens.append(d[2])
+            else:
+                cols.append(d[2])
+                lens.append(d[3])
+
+    def append(self, d):
+        self.extend((d,))
+
+    def __len__(self):
+        return len(self.lens)
+
+    def __iter__(self):
+        sizes = KIND_SIZES
+        for k, y, x, n in zip(self.kinds, self.rows, self.cols, self.lens):
+            size = sizes[k]
+            if size == 2:
+                yield (KINDS[k], y)
+            elif size == 3:
+                yield (KINDS[k], y, n)
+            else:
+                yield (KINDS[k], y, x, n)
+
+    def __getitem__(self, n):
+        if not isinstance(n, slice):
+            if not -len(self) <= n < len(self):
+                raise IndexError('DiffEvents index out of range')
+            return next(iter(self[n:n+1 or None]))
+        part = DiffEvents()
+        part.kinds = self.kinds[n]
+        part.rows = self.rows[n]
+        part.cols = self.cols[n]
+        part.lens = self.lens[n]
+        return part
+
+    def between(self, side, lo, hi):
+        """
+        DiffEvents of side ('-' for a, '+' for b) with lines lo...hi-1,
+        in order of events; found by bisect in index of event positions
+        sorted by line, the index is made again only after events were
+        added
+        """
+        count = len(self)
+        if self._index is None or self._index[0] != count:
+            sides = KIND_SIDES
+            found = ([], [])
+            for n, k in zip(range(count), self.kinds):
+                found[sides[k]].append(n)
+            rows = self.rows
+            index = []
+            for pos in found:
+                pos.sort(key=rows.__getitem__)
+                index.append((array('i', [rows[n] for n in pos]),
+                              array('i', pos)))
+            self._index = (count, index)
+        lines, pos = self._index[1][side == '+']
+        part = DiffEvents()
+        for n in sorted(pos[bisect_left(lines, lo):bisect_left(lines, hi)]):
+            part.kinds.append(self.kinds[n])
+            part.rows.append(self.rows[n])
+            part.cols.append(self.cols[n])
+            part.lens.append(self.lens[n])
+        return part
+
+    def dump(self):
+        "bytes of all columns, for DiffEvents.load"
+        return [col.tobytes() for col in
+                (self.kinds, self.rows, self.cols, self.lens)]
+
+    @classmethod
+    def load(cls, data):
+        events = cls()
+        for col, b in zip((events.kinds, events.rows, events.cols,
+                           events.lens), data):
+            col.frombytes(b)
+        if not len(events.kinds) == len(events.rows) == len(events.cols) \
+                == len(events.lens):
+            raise ValueError('bad columns of DiffEvents')
+        return events
 
 
 class Differ:
@@ -30,34 +222,179 @@ class Differ:
          -- detail paint deleted symbols in file a
          ++ detail paint added symbols in file b
               return (id, y, x, nlen)
+    -m / +m paint line of a / b moved to / from line y2 of b / a
+              return (id, y, y2)
     """
+    matcher = SequenceMatcher  # used to compare lines for detail
+    # attributes which change the result of compare()
+    OPTIONS = ('withdetail', 'ratio', 'engine', 'replace_limit',
+               'granularity', 'token_min_chars', 'ignore_space',
+               'ignore_case', 'ignore_patterns', 'detect_moves')
+
     def __init__(self, a='', b=''):
         self.withdetail = True
         self.ratio = 0.75
+        self.engine = 'difflib'
+        self.replace_limit = 10000
+        self.granularity = 'auto'  # of changed parts in lines
+        self.token_min_chars = TOKEN_MIN_CHARS
+        # lines are matched by keys made with these, see line_key
+        self.ignore_space = 'none'
+        self.ignore_case = False
+        self.ignore_patterns = ()
+        self.detect_moves = True
+        self.moved = ({}, {})  # {line of a: line of b}, {line of b: line of a}
+        # processes for detail of replace blocks, not used without fork:
+        # threads would only add overhead, detail holds the GIL
+        self.workers = 0
+        # function checked during compare, True stops it with Cancelled
+        self.stop = None
         self.set_seqs(a, b)
-        self.diffmap = []
+        self.diffmap = DiffMap()
 
     def set_seqs(self, a, b):
         self.a = a
         self.b = b
+        self.a_ids = self.b_ids = None
+
+    def get_opcodes(self):
+        engine = ENGINES.get(self.engine, difflib_blocks)
+        if engine is histogram_blocks or engine is myers_blocks:
+            engine = partial(engine, check=self.check)
+        self.a_ids, self.b_ids = intern_lines(self.a, self.b,
+                                              line_key(self.ignore_space,
+                                                       self.ignore_case,
+                                                       self.ignore_patterns))
+        self.check()
+        return get_opcodes(anchored_blocks(engine, self.a_ids, self.b_ids,
+                                           self.check))
+
+    def check(self):
+        "raise Cancelled if stop() is True"
+        if self.stop is not None and self.stop():
+            raise Cancelled
 
     def compare(self):
-        self.diffmap = []
-        diff = SequenceMatcher(None, self.a, self.b)
-        for tag, i1, i2, j1, j2 in diff.get_opcodes():
+        self.diffmap = DiffMap()
+        opcodes = self.get_opcodes()
+        self.moved = self.find_moves(opcodes) if self.detect_moves \
+            else ({}, {})
+        if self.withdetail and self.workers > 1 and HAS_FORK:
+            big = [op for op in opcodes if self._parallel(*op)]
+            if len(big) > 1:
+                options = self.options()
+                blocks = [(self.a[i1:i2], i1, self.b[j1:j2], j1, options)
+                          for tag, i1, i2, j1, j2 in big]
+                with process_pool(min(self.workers, len(blocks))) as pool:
+                    done = pool.map(replace_events, blocks)
+                    yield from self._compare(opcodes, done,
+                                             {op[1] for op in big})
+                return
+        yield from self._compare(opcodes)
+
+    def _parallel(self, tag, i1, i2, j1, j2):
+        "True if detail of this block can be made by workers"
+        moved_a, moved_b = self.moved
+        return tag == 'replace' and \
+            (i2-i1)*(j2-j1) >= PARALLEL_MIN_PAIRS and \
+            not any(y in moved_a for y in range(i1, i2)) and \
+            not any(y in moved_b for y in range(j1, j2))
+
+    def find_moves(self, opcodes):
+        """
+        find runs of deleted lines which are inserted elsewhere: lines of b
+        from changed blocks are indexed by line id, each deleted line is
+        looked up there and the longest equal run from it is taken, if it
+        has at least MOVE_MIN_LINES not blank lines; these lines are not
+        compared by symbols
+        return ({line of a: line of b}, {line of b: line of a})
+        """
+        a, b, a_ids, b_ids = self.a, self.b, self.a_ids, self.b_ids
+        free_a, free_b = bytearray(len(a)), bytearray(len(b))
+        index = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != 'equal':
+                free_a[i1:i2] = b'\1' * (i2-i1)
+                free_b[j1:j2] = b'\1' * (j2-j1)
+                for y in range(j1, j2):
+                    index.setdefault(b_ids[y], []).append(y)
+        moved_a, moved_b = {}, {}
+        if not index:
+            return moved_a, moved_b
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal' or tag == 'insert':
+                continue
+            self.check()
+            i = i1
+            while i < i2:
+                if not a[i].strip():
+                    i += 1
+                    continue
+                best, best_len = None, 0
+                found = index.get(a_ids[i], ())
+                if len(found) > MOVE_CANDIDATES:
+                    # too common line, like "}", does not start a move
+                    found = ()
+                for j in found:
+                    n = 0
+                    while i+n < len(a) and j+n < len(b) and \
+                            free_a[i+n] and free_b[j+n] and \
+                            a_ids[i+n] == b_ids[j+n]:
+                        n += 1
+                    if n > best_len:
+                        best, best_len = j, n
+                if best is None or sum(1 for s in a[i:i+best_len]
+                                       if s.strip()) < MOVE_MIN_LINES:
+                    i += 1
+                    continue
+                for n in range(best_len):
+                    moved_a[i+n] = best+n
+                    moved_b[best+n] = i+n
+                free_a[i:i+best_len] = free_b[best:best+best_len] = \
+                    bytes(best_len)
+                i += best_len
+        return moved_a, moved_b
+
+    def options(self):
+        return {k: getattr(self, k) for k in self.OPTIONS}
+
+    def set_options(self, options):
+        for k, v in options.items():
+            setattr(self, k, v)
+
+    def events(self):
+        "result of compare() as DiffEvents"
+        return DiffEvents(self.compare())
+
+    def _compare(self, opcodes, done=None, parallel=()):
+        """
+        events of opcodes; done: events of replace blocks starting at lines
+        parallel of a, made by workers, in order
+        """
+        moved_a, moved_b = self.moved
+        for tag, i1, i2, j1, j2 in opcodes:
             delta = i1-i2-j1+j2
             if tag != 'equal':
                 self.diffmap.append([i1, i2, j1, j2])
             if tag == 'delete':
                 yield (B_GAP, j2, abs(delta))
                 for y in range(i1, i2):
-                    yield (A_LINE_DEL, y)
+                    yield (A_LINE_MOVED, y, moved_a[y]) if y in moved_a \
+                        else (A_LINE_DEL, y)
             elif tag == 'insert':
                 yield (A_GAP, i2, delta)
                 for y in range(j1, j2):
-                    yield (B_LINE_ADD, y)
+                    yield (B_LINE_MOVED, y, moved_b[y]) if y in moved_b \
+                        else (B_LINE_ADD, y)
             elif tag == 'replace':
-                if self.withdetail:
+                rows_a = [y for y in range(i1, i2) if y not in moved_a]
+                rows_b = [y for y in range(j1, j2) if y not in moved_b]
+                if len(rows_a) < i2-i1 or len(rows_b) < j2-j1:
+                    yield from self._moved_replace(rows_a, i1, i2,
+                                                   rows_b, j1, j2)
+                elif i1 in parallel:
+                    yield from next(done)
+                elif self.withdetail:
                     yield from self._fancy_replace(self.a, i1, i2,
                                                    self.b, j1, j2)
                 else:
@@ -73,19 +410,150 @@ class Differ:
                         yield (B_LINE_CHANGE, y)
                         yield (B_DECOR_YELLOW, y)
 
+    def _moved_replace(self, rows_a, i1, i2, rows_b, j1, j2):
+        """
+        replace block with moved lines: they get only move events, other
+        lines rows_a, rows_b are compared as if moved ones were not there
+        """
+        moved_a, moved_b = self.moved
+        for y in range(i1, i2):
+            if y in moved_a:
+                yield (A_LINE_MOVED, y, moved_a[y])
+        for y in range(j1, j2):
+            if y in moved_b:
+                yield (B_LINE_MOVED, y, moved_b[y])
+        if not self.withdetail:
+            delta = i1-i2-j1+j2
+            if delta > 0:
+                yield (A_GAP, i2, delta)
+            elif delta < 0:
+                yield (B_GAP, j2, -delta)
+            for y in rows_a:
+                yield (A_LINE_CHANGE, y)
+                yield (A_DECOR_YELLOW, y)
+            for y in rows_b:
+                yield (B_LINE_CHANGE, y)
+                yield (B_DECOR_YELLOW, y)
+            return
+        a = [self.a[y] for y in rows_a]
+        b = [self.b[y] for y in rows_b]
+        for d in self._fancy_replace(a, 0, len(a), b, 0, len(b)):
+            rows, end = (rows_a, i2) if d[0][0] == '-' else (rows_b, j2)
+            y = rows[d[1]] if d[1] < len(rows) else end
+            yield (d[0], y) + d[2:]
+        # gaps above made other lines even, add gap for moved ones
+        delta = (i2-i1-len(rows_a)) - (j2-j1-len(rows_b))
+        if delta < 0:
+            yield (A_GAP, i2, -delta)
+        elif delta > 0:
+            yield (B_GAP, j2, delta)
+
+    def rediff(self, a, b):
+        """
+        compare again after a and/or b were edited, using diffmap of the
+        previous compare: only lines from the first to the last edited one,
+        widened to equal lines around them, are compared
+        return None if nothing changed, else (alo, ahi, blo, bhi, events),
+        new lines alo...ahi-1 and blo...bhi-1 must be repainted with events
+        """
+        def edited(old, new):
+            n = min(len(old), len(new))
+            head = 0
+            while head < n and old[head] == new[head]:
+                head += 1
+            if head == len(old) == len(new):
+                return None
+            tail = 0
+            while tail < n-head and old[-tail-1] == new[-tail-1]:
+                tail += 1
+            return head, len(old)-tail
+
+        a_edit, b_edit = edited(self.a, a), edited(self.b, b)
+        if a_edit is None and b_edit is None:
+            return None
+        a_head, a_end = a_edit or (len(self.a), 0)
+        b_head, b_end = b_edit or (len(self.b), 0)
+
+        # equal runs (i, j, n) between hunks of diffmap
+        runs, i, j = [], 0, 0
+        for i1, i2, j1, j2 in self.diffmap:
+            runs.append((i, j, i1-i))
+            i, j = i2, j2
+        runs.append((i, j, len(self.a)-i))
+
+        # start inside of an equal run, not just after a hunk, because
+        # the gap of that hunk is painted on the line before the start
+        r = 0
+        while r+1 < len(runs) and runs[r+1][0] <= a_head and \
+                runs[r+1][1] <= b_head:
+            r += 1
+        i, j, n = runs[r]
+        t = max(min(a_head-i, b_head-j, n)-REDIFF_MARGIN, 0)
+        while t == 0 and r > 0:
+            r -= 1
+            i, j, n = runs[r]
+            t = max(n-REDIFF_MARGIN, 0)
+        alo, blo = i+t, j+t
+
+        # end inside of an equal run too, not just before a hunk
+        r = len(runs)-1
+        while r > 0 and runs[r-1][0]+runs[r-1][2] >= a_end and \
+                runs[r-1][1]+runs[r-1][2] >= b_end:
+            r -= 1
+        i, j, n = runs[r]
+        t = min(max(a_end-i, b_end-j, 0)+REDIFF_MARGIN, n)
+        while t == n and r+1 < len(runs):
+            r += 1
+            i, j, n = runs[r]
+            t = min(REDIFF_MARGIN, n)
+        da, db = len(a)-len(self.a), len(b)-len(self.b)
+        ahi, bhi = i+t+da, j+t+db
+
+        part = Differ(a[alo:ahi], b[blo:bhi])
+        part.set_options(self.options())
+        events = shift_events(part.compare(), alo, blo)
+
+        hunks = [h for h in self.diffmap if h[1] <= alo and h[3] <= blo]
+        hunks += [[i1+alo, i2+alo, j1+blo, j2+blo]
+                  for i1, i2, j1, j2 in part.diffmap]
+        hunks += [[i1+da, i2+da, j1+db, j2+db]
+                  for i1, i2, j1, j2 in self.diffmap
+                  if i1 >= ahi-da and j1 >= bhi-db]
+        self.diffmap = DiffMap(hunks)
+        self.set_seqs(a, b)
+        return alo, ahi, blo, bhi, events
+
     def _fancy_replace(self, a, alo, ahi, b, blo, bhi):
+        if self.replace_limit and ahi-alo+bhi-blo > self.replace_limit:
+            yield from self._plain_replace(a, alo, ahi, b, blo, bhi)
+            return
+        if (ahi-alo)*(bhi-blo) > FANCY_INDEX_PAIRS:
+            yield from self._indexed_replace(a, alo, ahi, b, blo, bhi)
+            return
         best_ratio, cutoff = self.ratio-0.01, self.ratio
-        diff = SequenceMatcher(None)
+        diff = self.matcher(None)
+        parts = self._long_parts()
+
         eqi, eqj = None, None
         for j in range(blo, bhi):
+            self.check()
             bj = b[j]
-            diff.set_seq2(bj)
+            long_b = len(bj) > self.token_min_chars
+            if not long_b:
+                diff.set_seq2(bj)
             for i in range(alo, ahi):
                 ai = a[i]
                 if ai == bj:
                     if eqi is None:
                         eqi, eqj = i, j
                     continue
+                if long_b or len(ai) > self.token_min_chars:
+                    # chars of long lines are mostly junk for the
+                    # matcher, they are scored by parts
+                    ratio = part_ratio(parts(ai), parts(bj), best_ratio)
+                    if ratio > best_ratio:
+                        best_ratio, best_i, best_j = ratio, i, j
+                    continue
                 diff.set_seq1(ai)
                 if diff.real_quick_ratio() > best_ratio and \
                         diff.quick_ratio() > best_ratio and \
@@ -99,31 +567,121 @@ class Differ:
         else:
             eqi = None
         yield from self._fancy_helper(a, alo, best_i, b, blo, best_j)
-        aelt, belt = a[best_i], b[best_j]
         if eqi is None:
-            diff.set_seqs(aelt, belt)
-            deca, decb = 0, 0
-            for tag, ai1, ai2, bj1, bj2 in diff.get_opcodes():
-                la, lb = ai2 - ai1, bj2 - bj1
-                if tag == 'delete':
-                    deca += 1
-                    yield (A_SYMBOL_DEL, best_i, ai1, la)
-                elif tag == 'insert':
-                    decb += 1
-                    yield (B_SYMBOL_ADD, best_j, bj1, lb)
-                elif tag == 'replace':
-                    deca += 1
-                    decb += 1
-                    yield (A_SYMBOL_DEL, best_i, ai1, la)
-                    yield (B_SYMBOL_ADD, best_j, bj1, lb)
-            yield (A_LINE_CHANGE, best_i)
-            yield (B_LINE_CHANGE, best_j)
-            yield (A_DECOR_YELLOW, best_i) if deca == 0 else \
-                  (A_DECOR_RED, best_i)
-            yield (B_DECOR_YELLOW, best_j) if decb == 0 else \
-                  (B_DECOR_GREEN, best_j)
+            yield from self._line_detail(a, best_i, b, best_j)
         yield from self._fancy_helper(a, best_i+1, ahi, b, best_j+1, bhi)
 
+    def _long_parts(self):
+        """
+        function which splits lines longer than token_min_chars for
+        scoring, by parts of granularity (tokens for 'auto' and 'char');
+        lines are split once
+        """
+        split = SPLIT_RE.get(self.granularity, SPLIT_RE['token']).findall
+        cache = {}
+
+        def parts(s):
+            if s not in cache:
+                cache[s] = split(s)
+            return cache[s]
+        return parts
+
+    def _mode(self, ai, bj):
+        "granularity of detail for lines ai, bj"
+        if self.granularity == 'auto':
+            return 'token' if max(len(ai), len(bj)) > self.token_min_chars \
+                else 'char'
+        return self.granularity
+
+    def _line_detail(self, a, i, b, j):
+        ai, bj = a[i], b[j]
+        mode = self._mode(ai, bj)
+        if mode in SPLIT_RE:
+            # compare lists of parts, columns are taken from offsets of parts
+            split = SPLIT_RE[mode].findall
+            ai, bj = split(ai), split(bj)
+            acol = array('i', accumulate(map(len, ai), initial=0))
+            bcol = array('i', accumulate(map(len, bj), initial=0))
+            opcodes = get_opcodes(part_blocks(ai, bj))
+        else:
+            acol = bcol = range(max(len(ai), len(bj))+1)
+            opcodes = self.matcher(None, ai, bj).get_opcodes()
+        deca, decb = 0, 0
+        for tag, ai1, ai2, bj1, bj2 in opcodes:
+            la, lb = acol[ai2] - acol[ai1], bcol[bj2] - bcol[bj1]
+            ai1, bj1 = acol[ai1], bcol[bj1]
+            if tag == 'delete':
+                deca += 1
+                yield (A_SYMBOL_DEL, i, ai1, la)
+            elif tag == 'insert':
+                decb += 1
+                yield (B_SYMBOL_ADD, j, bj1, lb)
+            elif tag == 'replace':
+                deca += 1
+                decb += 1
+                yield (A_SYMBOL_DEL, i, ai1, la)
+                yield (B_SYMBOL_ADD, j, bj1, lb)
+        yield (A_LINE_CHANGE, i)
+        yield (B_LINE_CHANGE, j)
+        yield (A_DECOR_YELLOW, i) if deca == 0 else \
+              (A_DECOR_RED, i)
+        yield (B_DECOR_YELLOW, j) if decb == 0 else \
+              (B_DECOR_GREEN, j)
+
+    def _indexed_replace(self, a, alo, ahi, b, blo, bhi):
+        """
+        _fancy_replace for big blocks: score only candidate pairs from
+        similar_pairs, then take pairs from the most similar down, skipping
+        those which cross already taken ones (the same pairs which
+        _fancy_replace recursion would take)
+        """
+        pairs = sorted(similar_pairs(a, alo, ahi, b, blo, bhi, self.ratio,
+                                     self.matcher, self.token_min_chars,
+                                     self._long_parts(), self.check),
+                       key=lambda p: (-p[2], p[0], p[1]))
+        took_i, took_j = [], []
+        for j, i, _ in pairs:
+            k = bisect_left(took_i, i)
+            if k < len(took_i) and took_i[k] == i or \
+                    k and took_j[k-1] >= j or \
+                    k < len(took_j) and took_j[k] <= j:
+                continue
+            took_i.insert(k, i)
+            took_j.insert(k, j)
+        took_i.append(ahi)
+        took_j.append(bhi)
+        for i, j in zip(took_i, took_j):
+            yield from self._identical_split(a, alo, i, b, blo, j)
+            if i < ahi:
+                yield from self._line_detail(a, i, b, j)
+            alo, blo = i+1, j+1
+
+    def _identical_split(self, a, alo, ahi, b, blo, bhi):
+        """
+        part of block without similar lines: keep identical lines in
+        place, the rest is plain replace
+        """
+        where = {}
+        for i in range(alo, ahi):
+            where.setdefault(a[i], []).append(i)
+        for j in range(blo, bhi):
+            found = where.get(b[j])
+            if found is None:
+                continue
+            k = bisect_left(found, alo)
+            if k == len(found):
+                continue
+            i = found[k]
+            if alo < i and blo < j:
+                yield from self._plain_replace(a, alo, i, b, blo, j)
+            else:
+                yield from self._fancy_helper(a, alo, i, b, blo, j)
+            alo, blo = i+1, j+1
+        if alo < ahi and blo < bhi:
+            yield from self._plain_replace(a, alo, ahi, b, blo, bhi)
+        else:
+            yield from self._fancy_helper(a, alo, ahi, b, blo, bhi)
+
     def _fancy_helper(self, a, alo, ahi, b, blo, bhi):
         if alo < ahi:
             if blo < bhi:
@@ -149,3 +707,468 @@ class Differ:
             yield (B_LINE_ADD, y)
         for y in range(alo, ahi):
             yield (A_LINE_DEL, y)
+
+
+def shift_events(events, alo, blo):
+    "return list of events with lines of a moved by alo, of b by blo"
+    res = []
+    for d in events:
+        kind = d[0]
+        if kind == A_LINE_MOVED:
+            res.append((kind, d[1] + alo, d[2] + blo))
+        elif kind == B_LINE_MOVED:
+            res.append((kind, d[1] + blo, d[2] + alo))
+        else:
+            res.append((kind, d[1] + (alo if kind[0] == '-' else blo)) +
+                       d[2:])
+    return res
+
+
+def part_blocks(a, b):
+    """
+    matching blocks of two lists of line parts (words, tokens); parts are
+    matched as ints by histogram_blocks, so frequent ones like ',' are not
+    junked as SequenceMatcher autojunk does
+    """
+    return histogram_blocks(*intern_lines(a, b))
+
+
+def part_ratio(a, b, cutoff=0.0):
+    """
+    SequenceMatcher.ratio of two lists of line parts, by part_blocks;
+    0.0 if cheap upper bounds of it are not above cutoff
+    """
+    total = len(a)+len(b)
+    if not total:
+        return 1.0
+    if 2.0*min(len(a), len(b))/total <= cutoff or \
+            2.0*sum((Counter(a) & Counter(b)).values())/total <= cutoff:
+        return 0.0
+    return 2.0*sum(n for _, _, n in part_blocks(a, b))/total
+
+
+def replace_events(block):
+    """
+    detail events of one replace block (a, alo, b, blo, Differ options),
+    for workers of Differ.compare
+    """
+    a, alo, b, blo, options = block
+    diff = Differ(a, b)
+    diff.set_options(options)
+    return shift_events(diff._fancy_replace(a, 0, len(a), b, 0, len(b)),
+                        alo, blo)
+
+
+def process_pool(workers):
+    """
+    pool of processes started by fork, the plugin cannot start new
+    interpreters from CudaText; threads where there is no fork, they help
+    only where work waits for disk (folders.compare_folders)
+    """
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        return ThreadPoolExecutor(workers)
+    return ProcessPoolExecutor(workers, mp_context=ctx)
+
+
+def similar_pairs(a, alo, ahi, b, blo, bhi, cutoff, matcher=SequenceMatcher,
+                  long_chars=TOKEN_MIN_CHARS, parts=None, check=None):
+    """
+    yield (j, i, ratio) for not equal lines b[j], a[i] with ratio at least
+    cutoff; for each b[j] only FANCY_CANDIDATES lines of a sharing most
+    3-grams with it are scored, 3-grams found in more than
+    FANCY_MAX_POSTING lines of a are ignored as not telling anything;
+    pairs with a line longer than long_chars are scored by part_ratio of
+    parts(line), tokens by default; check() is called for each b[j]
+    """
+    def grams(s):
+        s = s.strip()
+        if len(s) < 8:
+            # too few 3-grams in short lines, add 2-grams
+            return {s[k:k+2] for k in range(len(s)-1)} | \
+                   {s[k:k+3] for k in range(len(s)-2)} | {s}
+        return {s[k:k+3] for k in range(len(s)-2)}
+
+    index = {}
+    for i in range(alo, ahi):
+        for g in grams(a[i]):
+            index.setdefault(g, []).append(i)
+    for g in [g for g, found in index.items()
+              if len(found) > FANCY_MAX_POSTING]:
+        del index[g]
+
+    if parts is None:
+        parts = SPLIT_RE['token'].findall
+    diff = matcher(None)
+    for j in range(blo, bhi):
+        if check is not None:
+            check()
+        bj = b[j]
+        hits = Counter()
+        for g in grams(bj):
+            found = index.get(g)
+            if found:
+                hits.update(found)
+        if not hits:
+            continue
+        long_b = len(bj) > long_chars
+        if not long_b:
+            diff.set_seq2(bj)
+        for i, _ in hits.most_common(FANCY_CANDIDATES):
+            ai = a[i]
+            if ai == bj:
+                continue
+            if long_b or len(ai) > long_chars:
+                ratio = part_ratio(parts(ai), parts(bj), cutoff-1e-9)
+                if ratio >= cutoff:
+                    yield j, i, ratio
+                continue
+            diff.set_seq1(ai)
+            if diff.real_quick_ratio() >= cutoff and \
+                    diff.quick_ratio() >= cutoff:
+                ratio = diff.ratio()
+                if ratio >= cutoff:
+                    yield j, i, ratio
+
+
+def line_key(ignore_space='none', ignore_case=False, ignore_patterns=()):
+    """
+    function which makes the key of a line to match lines by, or None to
+    match lines as they are; ignore_space: 'eol' ignores line ends,
+    'change' changes of spaces amount, 'all' all spaces; ignore_patterns:
+    regexes, found texts are all taken as equal
+    """
+    steps = [partial(re.compile(p).sub, '\0') for p in ignore_patterns]
+    if ignore_space == 'eol':
+        steps.append(lambda s: s.rstrip('\r\n'))
+    elif ignore_space == 'change':
+        steps.append(lambda s: SPACES_RE.sub(' ', s).strip())
+    elif ignore_space == 'all':
+        steps.append(lambda s: ''.join(s.split()))
+    if ignore_case:
+        steps.append(str.casefold)
+    if not steps:
+        return None
+
+    def key(s):
+        for step in steps:
+            s = step(s)
+        return s
+    return key
+
+
+def intern_lines(a, b, key=None):
+    """
+    map every distinct line of a and b to a small int, so engines compare
+    ints instead of strings; return two array('i')
+    if key is given, lines with equal key(line) get equal ints; else if
+    both a and b have line hashes (mapped.MappedLines), the hashes are
+    mapped instead of lines, so line strings are not made
+    """
+    if key is not None:
+        # keys are made once, only distinct ones are kept
+        ids = {}
+        add = ids.setdefault
+        return array('i', [add(k, len(ids)) for k in map(key, a)]), \
+            array('i', [add(k, len(ids)) for k in map(key, b)])
+    if hasattr(a, 'hashes') and hasattr(b, 'hashes'):
+        a, b = a.hashes, b.hashes
+    ids = {s: n for n, s in enumerate(dict.fromkeys(chain(a, b)))}
+    return array('i', map(ids.__getitem__, a)), \
+        array('i', map(ids.__getitem__, b))
+
+
+def anchored_blocks(engine, a, b, check=None):
+    """
+    strip common head and tail, then split the rest at lines which occur
+    exactly once in both a and b (longest increasing run of them, like
+    patience diff), and run engine only on the parts between these anchors;
+    check() is called before each engine run
+    """
+    alen, blen = len(a), len(b)
+    head = 0
+    while head < alen and head < blen and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < alen-head and tail < blen-head and \
+            a[alen-tail-1] == b[blen-tail-1]:
+        tail += 1
+    blocks = []
+    if head:
+        blocks.append((0, 0, head))
+    if tail:
+        blocks.append((alen-tail, blen-tail, tail))
+    alo, ahi, blo, bhi = head, alen-tail, head, blen-tail
+
+    a_cnt, b_cnt = Counter(a[alo:ahi]), Counter(b[blo:bhi])
+    a_pos = dict(zip(a[alo:ahi], range(alo, ahi)))
+    b_pos = dict(zip(b[blo:bhi], range(blo, bhi)))
+    # unique lines in order of b, then longest chain increasing in a
+    uniq = [(a_pos[x], j) for x, j in b_pos.items()
+            if b_cnt[x] == 1 and a_cnt.get(x) == 1]
+    tops, top_idx, prev = [], [], [-1] * len(uniq)
+    for n, (i, j) in enumerate(uniq):
+        if tops and i > tops[-1]:
+            k = len(tops)
+        else:
+            k = bisect_left(tops, i)
+        if k:
+            prev[n] = top_idx[k-1]
+        if k == len(tops):
+            tops.append(i)
+            top_idx.append(n)
+        else:
+            tops[k] = i
+            top_idx[k] = n
+    anchors = []
+    n = top_idx[-1] if top_idx else -1
+    while n >= 0:
+        anchors.append(uniq[n])
+        n = prev[n]
+    anchors.reverse()
+    anchors.append((ahi, bhi))
+
+    run = None
+    for i, j in anchors:
+        if run and run[0]+run[2] == i and run[1]+run[2] == j:
+            run[2] += 1
+        else:
+            if run:
+                blocks.append(tuple(run))
+            if alo < i and blo < j:
+                if check is not None:
+                    check()
+                for ai, bj, size in engine(a[alo:i], b[blo:j]):
+                    if size:
+                        blocks.append((alo+ai, blo+bj, size))
+            run = [i, j, 1]
+        alo, blo = i+1, j+1
+    if run[2] > 1:
+        blocks.append((run[0], run[1], run[2]-1))
+    return merge_blocks(blocks, alen, blen)
+
+
+def histogram_blocks(a, b, check=None):
+    """
+    histogram diff (like git --histogram): match the region around the
+    least frequent common line, then repeat for the parts left and right
+    of it; regions without such a line are left to myers_blocks;
+    check() is called for each region
+    return matching blocks (i, j, n) like SequenceMatcher, with the
+    trailing (len(a), len(b), 0) sentinel
+    """
+    blocks = []
+    todo = [(0, len(a), 0, len(b))]
+    while todo:
+        if check is not None:
+            check()
+        alo, ahi, blo, bhi = todo.pop()
+        # common head and tail never need the index
+        n = 0
+        while alo+n < ahi and blo+n < bhi and a[alo+n] == b[blo+n]:
+            n += 1
+        if n:
+            blocks.append((alo, blo, n))
+            alo, blo = alo+n, blo+n
+        n = 0
+        while alo < ahi-n and blo < bhi-n and a[ahi-n-1] == b[bhi-n-1]:
+            n += 1
+        if n:
+            blocks.append((ahi-n, bhi-n, n))
+            ahi, bhi = ahi-n, bhi-n
+        if alo == ahi or blo == bhi:
+            continue
+
+        index = {}
+        for i in range(alo, ahi):
+            index.setdefault(a[i], []).append(i)
+        best = None  # (count, -length, i, j)
+        j = blo
+        while j < bhi:
+            where = index.get(b[j])
+            if where is None or len(where) > HISTOGRAM_MAX_CHAIN or \
+                    (best and len(where) > best[0]):
+                j += 1
+                continue
+            next_j = j+1
+            for i in where:
+                si, sj = i, j
+                while si > alo and sj > blo and a[si-1] == b[sj-1]:
+                    si, sj = si-1, sj-1
+                ei, ej = i+1, j+1
+                while ei < ahi and ej < bhi and a[ei] == b[ej]:
+                    ei, ej = ei+1, ej+1
+                cand = (len(where), si-ei, si, sj)
+                if best is None or cand < best:
+                    best = cand
+                next_j = max(next_j, ej)
+            j = next_j
+
+        if best is None:
+            # only frequent lines: Myers has a cost cutoff, no quadratic
+            # matching of repeated lines
+            for i, j, n in myers_blocks(a[alo:ahi], b[blo:bhi], check):
+                if n:
+                    blocks.append((alo+i, blo+j, n))
+            continue
+        _, n, i, j = best
+        n = -n
+        blocks.append((i, j, n))
+        todo.append((alo, i, blo, j))
+        todo.append((i+n, ahi, j+n, bhi))
+
+    return merge_blocks(blocks, len(a), len(b))
+
+
+def myers_blocks(a, b, check=None):
+    """
+    Myers O(ND) diff in linear space: split on the middle snake and
+    repeat for both halves; when the edit cost of a part gets above
+    max(MYERS_MIN_COST, sqrt(N+M)) the part is split at the furthest
+    reaching point instead, so the result may be not minimal there;
+    check() is called for each part
+    """
+    blocks = []
+    todo = [(0, len(a), 0, len(b))]
+    while todo:
+        if check is not None:
+            check()
+        alo, ahi, blo, bhi = todo.pop()
+        n = 0
+        while alo+n < ahi and blo+n < bhi and a[alo+n] == b[blo+n]:
+            n += 1
+        if n:
+            blocks.append((alo, blo, n))
+            alo, blo = alo+n, blo+n
+        n = 0
+        while alo < ahi-n and blo < bhi-n and a[ahi-n-1] == b[bhi-n-1]:
+            n += 1
+        if n:
+            blocks.append((ahi-n, bhi-n, n))
+            ahi, bhi = ahi-n, bhi-n
+        if alo == ahi or blo == bhi:
+            continue
+        x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi)
+        if u > x:
+            blocks.append((alo+x, blo+y, u-x))
+        todo.append((alo, alo+x, blo, blo+y))
+        todo.append((alo+u, ahi, blo+v, bhi))
+    return merge_blocks(blocks, len(a), len(b))
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):
+    """
+    return (x, y, u, v) - the snake from (x, y) to (u, v), relative to
+    (alo, blo), which lies on some shortest edit path
+    """
+    n, m = ahi-alo, bhi-blo
+    delta = n-m
+    odd = delta & 1
+    limit = min((n+m+1)//2, max(MYERS_MIN_COST, isqrt(n+m)))
+    off = limit+1
+    # vf[k]: furthest x on forward diagonal k = x-y
+    # vb[k]: furthest x' on backward diagonal k = x'-y', x' = n-x, y' = m-y
+    vf = [0] * (2*off+1)
+    vb = [0] * (2*off+1)
+    for d in range(limit+1):
+        for k in range(-d, d+1, 2):
+            if k == -d or (k != d and vf[off+k-1] < vf[off+k+1]):
+                x = vf[off+k+1]
+            else:
+                x = vf[off+k-1]+1
+            y = x-k
+            sx, sy = x, y
+            while x < n and y < m and a[alo+x] == b[blo+y]:
+                x, y = x+1, y+1
+            vf[off+k] = x
+            if odd and -(d-1) <= delta-k <= d-1 and \
+                    x + vb[off+delta-k] >= n:
+                return sx, sy, x, y
+        for k in range(-d, d+1, 2):
+            if k == -d or (k != d and vb[off+k-1] < vb[off+k+1]):
+                x = vb[off+k+1]
+            else:
+                x = vb[off+k-1]+1
+            y = x-k
+            sx, sy = x, y
+            while x < n and y < m and a[ahi-x-1] == b[bhi-y-1]:
+                x, y = x+1, y+1
+            vb[off+k] = x
+            if not odd and -d <= delta-k <= d and \
+                    x + vf[off+delta-k] >= n:
+                return n-x, m-y, n-sx, m-sy
+
+    # too expensive: split at the forward or backward point which went
+    # furthest, without a snake
+    best, split = -1, None
+    for k in range(-limit, limit+1, 2):
+        x = min(vf[off+k], n)
+        y = min(x-k, m)
+        if 0 <= y and x+y > best and 0 < x+y < n+m:
+            best, split = x+y, (x, y)
+        x = min(vb[off+k], n)
+        y = min(x-k, m)
+        if 0 <= y and x+y > best and 0 < x+y < n+m:
+            best, split = x+y, (n-x, m-y)
+    x, y = split
+    return x, y, x, y
+
+
+def difflib_blocks(a, b):
+    return SequenceMatcher(None, a, b).get_matching_blocks()
+
+
+ENGINES = {
+    'difflib': difflib_blocks,
+    'histogram': histogram_blocks,
+    'myers': myers_blocks,
+    }
+
+
+def register_engine(name, func):
+    """
+    add line matching algorithm, usable as Differ.engine
+    func(a, b) must return matching blocks (i, j, n), sorted, with the
+    trailing (len(a), len(b), 0) sentinel, like
+    SequenceMatcher.get_matching_blocks
+    """
+    ENGINES[name] = func
+
+
+def merge_blocks(blocks, alen, blen):
+    """
+    sort matching blocks, join adjacent ones and add the sentinel
+    """
+    merged = []
+    for i, j, n in sorted(blocks):
+        if merged and merged[-1][0]+merged[-1][2] == i and \
+                merged[-1][1]+merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2]+n)
+        else:
+            merged.append((i, j, n))
+    merged.append((alen, blen, 0))
+    return merged
+
+
+def get_opcodes(blocks):
+    """
+    convert matching blocks to opcodes, the same as
+    SequenceMatcher.get_opcodes does
+    """
+    i = j = 0
+    opcodes = []
+    for ai, bj, size in blocks:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        i, j = ai+size, bj+size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
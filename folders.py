@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+
+from . import differ as df
+
+CHANGED = 'changed'
+ONLY_A = 'only_a'
+ONLY_B = 'only_b'
+BINARY = 'binary'
+UNREADABLE = 'unreadable'
+HASH_BLOCK = 1 << 20
+
+
+def walk(root):
+    "return {relative path: (size, mtime)} of all files in root"
+    files = {}
+    for folder, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in names:
+            fn = os.path.join(folder, name)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            files[os.path.relpath(fn, root)] = (st.st_size, st.st_mtime)
+    return files
+
+
+def file_hash(fn):
+    h = sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            h.update(block)
+    return h.digest()
+
+
+def same_content(fn_a, fn_b):
+    try:
+        return file_hash(fn_a) == file_hash(fn_b)
+    except OSError:
+        return False
+
+
+def diff_stat(fn_a, fn_b, engine='difflib'):
+    """
+    return (CHANGED, (deleted, added)) with numbers of lines,
+    (BINARY, None) for binary files, (UNREADABLE, None) if a file cannot
+    be read (like deleted after walk)
+    """
+    texts = []
+    for fn in (fn_a, fn_b):
+        try:
+            with open(fn, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return UNREADABLE, None
+        if b'\0' in data[:8192]:
+            return BINARY, None
+        texts.append(data.decode('utf-8', 'replace').splitlines(True))
+    diff = df.Differ(*texts)
+    diff.engine = engine
+    deleted = added = 0
+    for tag, i1, i2, j1, j2 in diff.get_opcodes():
+        if tag != 'equal':
+            deleted += i2 - i1
+            added += j2 - j1
+    return CHANGED, (deleted, added)
+
+
+def compare_folders(dir_a, dir_b, engine='difflib', workers=0,
+                    progress=None):
+    """
+    compare all files of two folders; files with equal size and mtime are
+    taken as identical, files with equal size are compared by hash, then
+    changed files are compared by lines in parallel
+    return (items, identical), items are (status, relative path, stat)
+    sorted by path, stat is (deleted, added) for CHANGED else None
+    progress(done, total) is called while files are compared
+    """
+    workers = workers or os.cpu_count() or 1
+    files_a, files_b = walk(dir_a), walk(dir_b)
+    items = [(ONLY_A, rel, None) for rel in files_a if rel not in files_b]
+    items += [(ONLY_B, rel, None) for rel in files_b if rel not in files_a]
+
+    maybe_same, changed = [], []
+    for rel, (size, mtime) in files_a.items():
+        other = files_b.get(rel)
+        if other is None or other == (size, mtime):
+            continue
+        (maybe_same if other[0] == size else changed).append(rel)
+
+    # sha1 of big blocks runs without GIL, so threads are enough
+    with ThreadPoolExecutor(workers) as pool:
+        same = pool.map(same_content,
+                        [os.path.join(dir_a, rel) for rel in maybe_same],
+                        [os.path.join(dir_b, rel) for rel in maybe_same])
+        changed += [rel for rel, eq in zip(maybe_same, same) if not eq]
+    identical = len(files_a) - len(changed) - \
+        sum(1 for item in items if item[0] == ONLY_A)
+
+    with df.process_pool(workers) as pool:
+        stats = pool.map(diff_stat,
+                         [os.path.join(dir_a, rel) for rel in changed],
+                         [os.path.join(dir_b, rel) for rel in changed],
+                         [engine] * len(changed),
+                         chunksize=max(1, len(changed) // (workers * 4)))
+        for n, (rel, (status, stat)) in enumerate(zip(changed, stats)):
+            items.append((status, rel, stat))
+            if progress:
+                progress(n + 1, len(changed))
+
+    items.sort(key=lambda item: item[1])
+    return items, identical
@@ -0,0 +1,82 @@
+import os
+import mmap
+from array import array
+from hashlib import sha1
+from itertools import accumulate
+
+BOM = b'\xef\xbb\xbf'
+READ_BLOCK = 1 << 24
+
+
+class MappedLines:
+    """
+    lines of a saved utf-8 file, read through mmap: only offsets and hashes
+    of lines are kept, line strings are decoded on access; line ends are
+    LF or CRLF, kept in lines like splitlines(True) does
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self._digest = None
+        self._file = open(fn, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file cannot be mapped
+            self._file.close()
+            raise
+        m = self._map
+        start = len(BOM) if m[:len(BOM)] == BOM else 0
+        self.starts = starts = array('q', [start])
+        # hashes of line bytes, for engines instead of line strings
+        self.hashes = hashes = array('q')
+        rest = b''
+        for pos in range(start, len(m), READ_BLOCK):
+            lines = (rest + m[pos:pos+READ_BLOCK]).split(b'\n')
+            rest = lines.pop()
+            hashes.extend(map(hash, lines))
+            end = starts[-1]
+            starts.extend(end + n for n in accumulate(len(s)+1 for s in lines))
+        if rest:
+            # last line without line end is not equal to the same with it
+            hashes.append(hash((rest,)))
+            starts.append(len(m))
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('line index out of range')
+        return self._map[self.starts[n]:self.starts[n+1]] \
+            .decode('utf-8', 'replace')
+
+    def __iter__(self):
+        return (self[n] for n in range(len(self)))
+
+    def __eq__(self, other):
+        if isinstance(other, MappedLines):
+            return len(self) == len(other) and self.digest() == other.digest()
+        return NotImplemented
+
+    def digest(self):
+        "sha1 of the mapped file"
+        if self._digest is None:
+            self._digest = sha1(self._map).digest()
+        return self._digest
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def can_map(fn, min_bytes):
+    "True if fn is a file at least min_bytes long (min_bytes > 0)"
+    try:
+        return min_bytes > 0 and os.path.getsize(fn) >= min_bytes
+    except OSError:
+        return False
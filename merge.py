@@ -0,0 +1,92 @@
+if __package__:
+    from . import differ as df
+else:
+    # imported by cli.py run as script
+    import differ as df
+
+OURS = 'ours'  # changed only in ours
+THEIRS = 'theirs'  # changed only in theirs
+BOTH = 'both'  # changed the same way in both
+CONFLICT = 'conflict'
+
+
+def changes(base, other, options=None):
+    "changed blocks [b1, b2, x1, x2] of other against base"
+    diff = df.Differ(base, other)
+    if options:
+        diff.set_options(options)
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in diff.get_opcodes()
+            if tag != 'equal']
+
+
+def merge3(base, ours, theirs, options=None):
+    """
+    three-way compare; return hunks (kind, b1, b2, o1, o2, t1, t2): lines
+    b1...b2-1 of base are changed to o1...o2-1 of ours and t1...t2-1 of
+    theirs; changes of both sides which overlap or touch are one hunk,
+    like in diff3; options are Differ options for both line diffs
+    """
+    sides = (changes(base, ours, options), changes(base, theirs, options))
+    pos = [0, 0]
+    # line shift of ours/theirs against base, after processed changes
+    delta = [0, 0]
+    hunks = []
+    while pos[0] < len(sides[0]) or pos[1] < len(sides[1]):
+        starts = [side[p][0] if p < len(side) else None
+                  for side, p in zip(sides, pos)]
+        lo = min(s for s in starts if s is not None)
+        hi = lo
+        before = list(delta)
+        changed = [False, False]
+        grown = True
+        while grown:
+            grown = False
+            for n, side in enumerate(sides):
+                while pos[n] < len(side) and side[pos[n]][0] <= hi:
+                    b1, b2, x1, x2 = side[pos[n]]
+                    hi = max(hi, b2)
+                    delta[n] += (x2-x1) - (b2-b1)
+                    pos[n] += 1
+                    changed[n] = grown = True
+        o1, o2 = lo + before[0], hi + delta[0]
+        t1, t2 = lo + before[1], hi + delta[1]
+        if not changed[1]:
+            kind = OURS
+        elif not changed[0]:
+            kind = THEIRS
+        elif ours[o1:o2] == theirs[t1:t2]:
+            kind = BOTH
+        else:
+            kind = CONFLICT
+        hunks.append((kind, lo, hi, o1, o2, t1, t2))
+    return hunks
+
+
+def merged_lines(base, ours, theirs, hunks, labels=('ours', 'theirs')):
+    """
+    yield lines of merge result: changes of both sides are taken,
+    conflicts are written with <<<<<<< ||||||| ======= >>>>>>> markers
+    """
+    b = 0
+    for kind, b1, b2, o1, o2, t1, t2 in hunks:
+        yield from base[b:b1]
+        b = b2
+        if kind == THEIRS:
+            yield from theirs[t1:t2]
+        elif kind != CONFLICT:
+            yield from ours[o1:o2]
+        else:
+            yield '<<<<<<< %s\n' % labels[0]
+            yield from _ended(ours[o1:o2])
+            yield '||||||| base\n'
+            yield from _ended(base[b1:b2])
+            yield '=======\n'
+            yield from _ended(theirs[t1:t2])
+            yield '>>>>>>> %s\n' % labels[1]
+    yield from base[b:]
+
+
+def _ended(lines):
+    "lines, the last one with line end, so a marker can follow it"
+    for s in lines:
+        yield s if s.endswith(('\n', '\r')) else s + '\n'
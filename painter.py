@@ -0,0 +1,200 @@
+import cudatext as ct
+
+from . import differ as df
+
+DIFF_TAG = 148
+NKIND_DELETED = 24
+NKIND_ADDED = 25
+NKIND_CHANGED = 26
+NKIND_MOVED = 27
+DECOR_CHAR = '■'
+LAZY_MARGIN = 60  # lines above/below the screen painted in advance
+LAZY_KEEP = 2000  # painted lines kept before far ones are deleted
+
+
+class Side:
+    """marks collected for one editor"""
+    def __init__(self):
+        self.bookmarks = {}  # row: nkind
+        self.decors = {}  # row: color
+        self.gaps = {}  # row: number of lines
+        self.attrs = []  # (color, y, x, nlen)
+
+
+class LazyMarkers:
+    """
+    symbol markers of one editor, painted only for lines near the
+    visible area; lines far from it are deleted when too many are painted
+    """
+    def __init__(self):
+        self.rows = {}  # row: [(color, x, nlen)]
+        self.painted = set()
+
+    def add(self, color, y, x, nlen):
+        self.rows.setdefault(y, []).append((color, x, nlen))
+
+    def replace(self, y1, y2, delta):
+        """
+        forget lines y1...y2-1 (new line numbers), lines after them
+        moved by delta lines
+        """
+        def moved(y):
+            return y if y < y1 else y + delta
+
+        old_end = y2 - delta
+        self.rows = {moved(y): m for y, m in self.rows.items()
+                     if not y1 <= y < old_end}
+        self.painted = {moved(y) for y in self.painted
+                        if not y1 <= y < old_end}
+
+    def paint(self, e):
+        "return number of editor calls"
+        top = e.get_prop(ct.PROP_LINE_TOP)
+        bottom = e.get_prop(ct.PROP_LINE_BOTTOM)
+        calls = 2
+        y1, y2 = max(top - LAZY_MARGIN, 0), bottom + LAZY_MARGIN
+        todo = [y for y in range(y1, y2)
+                if y in self.rows and y not in self.painted]
+        attrs = [(color, y, x, nlen)
+                 for y in todo for color, x, nlen in self.rows[y]]
+        for color, xs, ys, lens in Painter.join_attrs(attrs):
+            e.attr(ct.MARKERS_ADD_MANY, DIFF_TAG,
+                   xs,
+                   ys,
+                   lens,
+                   color_bg=color,
+                   show_on_map=True
+                   )
+            calls += 1
+        self.painted.update(todo)
+
+        if len(self.painted) > LAZY_KEEP:
+            y1, y2 = y1 - LAZY_KEEP // 2, y2 + LAZY_KEEP // 2
+            far = [y for y in self.painted if not y1 <= y < y2]
+            for y in far:
+                for color, x, nlen in self.rows.get(y, ()):
+                    e.attr(ct.MARKERS_DELETE_BY_POS, x=x, y=y)
+                    calls += 1
+            self.painted.difference_update(far)
+        return calls
+
+
+class Painter:
+    """
+    collect compare() events for both editors and paint them by kind:
+    one call per line for bookmarks, decor and gaps, and one
+    MARKERS_ADD_MANY call per color for symbol markers, with adjacent
+    markers joined; if lazy is given ({'-': LazyMarkers, '+': LazyMarkers}),
+    symbol markers are only stored there
+    """
+    def __init__(self, a_ed, b_ed, cfg, lazy=None):
+        self.eds = {'-': a_ed, '+': b_ed}
+        self.lazy = lazy
+        self.sides = {'-': Side(), '+': Side()}
+        self.colors = {
+            df.A_LINE_DEL: cfg.get('color_deleted'),
+            df.B_LINE_ADD: cfg.get('color_added'),
+            df.A_SYMBOL_DEL: cfg.get('color_deleted'),
+            df.B_SYMBOL_ADD: cfg.get('color_added'),
+            df.A_DECOR_YELLOW: cfg.get('color_changed'),
+            df.B_DECOR_YELLOW: cfg.get('color_changed'),
+            df.A_DECOR_RED: cfg.get('color_deleted'),
+            df.B_DECOR_GREEN: cfg.get('color_added'),
+            df.A_LINE_MOVED: cfg.get('color_moved'),
+            df.B_LINE_MOVED: cfg.get('color_moved'),
+        }
+        self.color_gaps = cfg.get('color_gaps')
+        self.calls = 0
+        # calls which painting of every event by itself would make
+        self.unbatched = 0
+
+    def add(self, events):
+        colors = self.colors
+        sides = self.sides
+        for d in events:
+            diff_id, y = d[0], d[1]
+            side = sides[diff_id[0]]
+            if diff_id == df.A_LINE_DEL or diff_id == df.B_LINE_ADD:
+                side.bookmarks[y] = NKIND_DELETED if diff_id == df.A_LINE_DEL \
+                                    else NKIND_ADDED
+                side.decors[y] = colors[diff_id]
+                # bookmark and decor
+                self.unbatched += 2
+            elif diff_id == df.A_LINE_MOVED or diff_id == df.B_LINE_MOVED:
+                side.bookmarks[y] = NKIND_MOVED
+                side.decors[y] = colors[diff_id]
+                self.unbatched += 2
+            elif diff_id == df.A_LINE_CHANGE or diff_id == df.B_LINE_CHANGE:
+                side.bookmarks[y] = NKIND_CHANGED
+                self.unbatched += 1
+            elif diff_id == df.A_GAP or diff_id == df.B_GAP:
+                side.gaps[y] = side.gaps.get(y, 0) + d[2]
+                # cell size and gap
+                self.unbatched += 2
+            elif diff_id == df.A_SYMBOL_DEL or diff_id == df.B_SYMBOL_ADD:
+                if self.lazy:
+                    self.lazy[diff_id[0]].add(colors[diff_id], y, d[2], d[3])
+                else:
+                    side.attrs.append((colors[diff_id], y, d[2], d[3]))
+                self.unbatched += 1
+            else:
+                side.decors[y] = colors[diff_id]
+                self.unbatched += 1
+
+    def apply(self):
+        for key, side in self.sides.items():
+            e = self.eds[key]
+            for row, nk in side.bookmarks.items():
+                self.call(e.bookmark, ct.BOOKMARK2_SET, row,
+                          nkind=nk,
+                          text="",
+                          auto_del=True,
+                          show=False,
+                          tag=DIFF_TAG
+                          )
+            for row, color in side.decors.items():
+                self.call(e.decor, ct.DECOR_SET, row, DIFF_TAG, DECOR_CHAR,
+                          color, bold=True)
+            if side.gaps:
+                _, h = self.call(e.get_prop, ct.PROP_CELL_SIZE)
+                for row, n in side.gaps.items():
+                    # gap line after row line
+                    self.call(e.gap, ct.GAP_ADD, row-1, 0,
+                              tag=DIFF_TAG,
+                              size=h * n,
+                              color=self.color_gaps
+                              )
+            for color, xs, ys, lens in self.join_attrs(side.attrs):
+                self.call(e.attr, ct.MARKERS_ADD_MANY, DIFF_TAG,
+                          xs,
+                          ys,
+                          lens,
+                          color_bg=color,
+                          show_on_map=True
+                          )
+        self.sides = {'-': Side(), '+': Side()}
+
+    @property
+    def saved(self):
+        return self.unbatched - self.calls
+
+    def call(self, func, *args, **kwargs):
+        self.calls += 1
+        return func(*args, **kwargs)
+
+    @staticmethod
+    def join_attrs(attrs):
+        """
+        return (color, xs, ys, lens) for each color, markers which
+        touch on the same line are joined
+        """
+        by_color = {}
+        for color, y, x, nlen in sorted(attrs, key=lambda m: (m[1], m[2])):
+            xs, ys, lens = by_color.setdefault(color, ([], [], []))
+            if ys and ys[-1] == y and xs[-1] + lens[-1] == x:
+                lens[-1] += nlen
+            else:
+                xs.append(x)
+                ys.append(y)
+                lens.append(nlen)
+        return [(color,) + m for color, m in by_color.items()]
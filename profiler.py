@@ -0,0 +1,87 @@
+from collections import Counter
+from difflib import SequenceMatcher
+from time import perf_counter
+
+from . import differ as df
+
+
+class NoProfile:
+    """profile which records nothing, used when profiling is off"""
+    def mark(self, phase):
+        pass
+
+
+NO_PROFILE = NoProfile()
+
+
+class Profile:
+    """
+    times of refresh phases and counters of one comparision;
+    mark(phase) adds time since the previous mark to phase
+    """
+    def __init__(self):
+        self.phases = {}
+        self.events = Counter()
+        self.ratio_calls = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.api_calls = 0
+        self.last = perf_counter()
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def count_events(self, events):
+        self.events.update(d[0] for d in events)
+
+    def as_dict(self):
+        return {
+            'phases': {k: round(v, 4) for k, v in self.phases.items()},
+            'total': round(sum(self.phases.values()), 4),
+            'events': dict(self.events),
+            'ratio_calls': self.ratio_calls,
+            'fancy_replace_depth': self.max_depth,
+            'api_calls': self.api_calls,
+        }
+
+    def report(self):
+        lines = ['%-28s %8.3f s' % (k, v) for k, v in self.phases.items()]
+        lines.append('%-28s %8.3f s' % ('total', sum(self.phases.values())))
+        lines.append('')
+        lines += ['events %-21s %8d' % (k, v)
+                  for k, v in sorted(self.events.items())]
+        lines.append('%-28s %8d' % ('ratio() calls', self.ratio_calls))
+        lines.append('%-28s %8d' % ('_fancy_replace depth', self.max_depth))
+        lines.append('%-28s %8d' % ('editor API calls', self.api_calls))
+        return '\n'.join(lines)
+
+
+class ProfiledDiffer(df.Differ):
+    """Differ which records line diff time, ratio() calls and recursion"""
+    def __init__(self, profile, a='', b=''):
+        super().__init__(a, b)
+        self.profile = profile
+
+        class Matcher(SequenceMatcher):
+            def ratio(m):
+                profile.ratio_calls += 1
+                return SequenceMatcher.ratio(m)
+
+        self.matcher = Matcher
+
+    def get_opcodes(self):
+        self.profile.mark('compare setup')
+        opcodes = super().get_opcodes()
+        self.profile.mark('line diff (%s)' % self.engine)
+        return opcodes
+
+    def _fancy_replace(self, a, alo, ahi, b, blo, bhi):
+        prof = self.profile
+        prof.depth += 1
+        prof.max_depth = max(prof.max_depth, prof.depth)
+        try:
+            yield from super()._fancy_replace(a, alo, ahi, b, blo, bhi)
+        finally:
+            prof.depth -= 1
@@ -12,17 +12,22 @@ class ScrollSplittedTab:
     def __init__(self, name):
         self.name = name
         self.tab_id = set()
+        self.sync = True
 
-    def toggle(self, on=True):
-        if on:
-            ev = 'on_tab_change,on_state,on_caret,on_change_slow'
+    def toggle(self, on=True, watch=False):
+        "on: sync scrolling, watch: need on_scroll without sync scrolling"
+        self.sync = on
+        if on or watch:
+            ev = 'on_tab_change,on_state,on_caret,on_change_slow,on_save'
             if ct.ed.get_prop(ct.PROP_TAB_ID) in self.tab_id:
-                ev = 'on_scroll,on_tab_change,on_state,on_caret,on_change_slow'
+                ev = 'on_scroll,on_tab_change,on_state,on_caret,on_change_slow,on_save'
         else:
-            ev = 'on_state,on_caret,on_change_slow'
+            ev = 'on_state,on_caret,on_change_slow,on_save'
         ct.app_proc(ct.PROC_SET_EVENTS, self.name+';'+ev+';;')
 
     def on_scroll(self, ed_self):
+        if not self.sync:
+            return
         if ed_self.get_prop(ct.PROP_SPLIT)[0] == '-':
             return
 
@@ -9,13 +9,16 @@ _ = get_translation(__file__)  # I18N
 class FileHistory:
     items = []
     section = 'recents'
+    loaded = False  # load() is called on first use, not on plugin import
 
     def __init__(self):
         self.filename = os.path.join(ct.app_path(ct.APP_DIR_SETTINGS), 'cuda_differ_history.ini')
-        self.max_size = appx.get_opt('ui_max_history_files', 25)
-        # print('Differ history max_size:', self.max_size)
+        self.max_size = 25
 
     def load(self):
+        self.loaded = True
+        self.max_size = appx.get_opt('ui_max_history_files', 25)
+        # print('Differ history max_size:', self.max_size)
         self.items = []
         for i in range(self.max_size):
             fn = ct.ini_read(self.filename, self.section, str(i), '')
@@ -43,7 +46,6 @@ class FileHistory:
 
 
 file_history = FileHistory()
-file_history.load()
 
 
 def center_ct():
@@ -61,6 +63,8 @@ class DifferDialog:
 
     def run(self):
         global file_history
+        if not file_history.loaded:
+            file_history.load()
         self.ready = False
         open_files = []
 
@@ -0,0 +1,42 @@
+import threading
+
+from .differ import DiffEvents, Cancelled
+
+
+class DiffJob(threading.Thread):
+    """
+    collect compare() events of differ in a background thread;
+    cancel() stops it at the next event or Differ.check, result is in
+    events; job after (cancelled one) is waited for before compare, so
+    cancelled jobs do not run along with the new one
+    """
+    def __init__(self, differ, after=None):
+        super().__init__(daemon=True)
+        # no process pool: fork from a thread of CudaText process may
+        # copy locks held by other threads and hang the child
+        differ.workers = 0
+        self.differ = differ
+        self.after = after
+        self.events = DiffEvents()
+        self.error = None
+        self.done = False
+        self._cancel = threading.Event()
+        differ.stop = self._cancel.is_set
+
+    def run(self):
+        if self.after is not None:
+            self.after.join()
+            self.after = None
+        try:
+            for d in self.differ.compare():
+                if self._cancel.is_set():
+                    return
+                self.events.append(d)
+        except Cancelled:
+            return
+        except Exception as e:
+            self.error = e
+        self.done = True
+
+    def cancel(self):
+        self._cancel.set()